@@ -1,391 +1,504 @@
 from model.DB_utils import *
-from model.table_joining_utils import join_tables
+from model.table_joining_utils import join_tables, update_point_ward_lookup, update_lsoa_ward_lookup, add_projected_geometry, build_ward_gdf
 
 from shapely.wkt import dumps as wkt_dumps
 from tqdm import tqdm
 import psutil
-from multiprocessing import Pool
+from multiprocessing import Pool, Queue, get_context, get_all_start_methods
+from collections import deque
+import queue
 import pandas as pd
 import time
+import sys
+
+
+# Source data of the build
+WARD_BOUNDARIES_PATH = "data/Wards_December_2016_Boundaries_UK_BFE_2022_-5810284385438997272"
+IMD_PATH = "data/imd2019lsoa.csv"
+
+# Final (enriched) crime schema, written once by the enrichment stage
+CRIME_COLUMNS = {
+    'crime_id':'TEXT PRIMARY KEY',
+    'month':'TEXT',
+    'reported_by':'TEXT',
+    'falls_within':'TEXT',
+    'long':'REAL',
+    'lat':'REAL',
+    'location':'TEXT',
+    'lsoa_code':'TEXT',
+    'crime_type':'TEXT',
+    'last_outcome_category':'TEXT',
+    'average_imd_decile': 'REAL',
+    'ward_code': 'TEXT',
+    'covid_indicator': 'REAL',
+    'stringency_index': 'REAL'
+}
+
+# Data every enrichment worker needs. Set in the parent before a fork Pool is created, so workers share
+# the prepared ward geometries & STRtree copy-on-write; init_worker fills them on platforms without fork
+_worker_imd_data = None
+_worker_ward_data = None
+_worker_point_wards = None
+_worker_lsoa_wards = None
+_worker_covid_data = None
+# Bounded queue the workers put their enriched batches on, drained by the one writer (the parent)
+_worker_result_queue = None
+
+
+def set_worker_data(imd_data: pd.DataFrame, ward_gdf, point_wards: pd.DataFrame, lsoa_wards: pd.DataFrame, covid_data: pd.DataFrame, result_queue) -> None:
+    global _worker_imd_data, _worker_ward_data, _worker_point_wards, _worker_lsoa_wards, _worker_covid_data, _worker_result_queue
+
+    _worker_imd_data = imd_data
+    _worker_ward_data = ward_gdf
+    _worker_point_wards = point_wards
+    _worker_lsoa_wards = lsoa_wards
+    _worker_covid_data = covid_data
+    _worker_result_queue = result_queue
+
+
+def init_worker(imd_parquet_loc: str, ward_parquet_loc: str, point_ward_parquet_loc: str, lsoa_ward_parquet_loc: str, covid_parquet_loc: str, result_queue) -> None:
+    # Load IMD, ward, point->ward & LSOA->ward lookups and covid data inside each process from Parquet
+    set_worker_data(
+        imd_data=pd.read_parquet(imd_parquet_loc),
+        ward_gdf=build_ward_gdf(pd.read_parquet(ward_parquet_loc)),
+        point_wards=pd.read_parquet(point_ward_parquet_loc),
+        lsoa_wards=pd.read_parquet(lsoa_ward_parquet_loc),
+        covid_data=pd.read_parquet(covid_parquet_loc),
+        result_queue=result_queue
+    )
+
+
+def create_enrichment_pool(n_workers: int, imd_data: pd.DataFrame, ward_data: pd.DataFrame, point_wards: pd.DataFrame, lsoa_wards: pd.DataFrame, covid_data: pd.DataFrame, parquet_locs: tuple[str, str, str, str, str], queue_size: int):
+    # Returns the pool & the bounded result queue (at most queue_size enriched batches wait for the writer)
+    if "fork" in get_all_start_methods():
+        # Prepare once here, forked workers inherit it without any loading or pickling
+        context = get_context("fork")
+        result_queue = context.Queue(maxsize=queue_size)
+        set_worker_data(imd_data, build_ward_gdf(ward_data), point_wards, lsoa_wards, covid_data, result_queue)
+        return context.Pool(n_workers), result_queue
+
+    for data, parquet_loc in zip([imd_data, ward_data, point_wards, lsoa_wards, covid_data], parquet_locs):
+        data.to_parquet(parquet_loc, index=False)
+
+    result_queue = Queue(maxsize=queue_size)
+    return Pool(n_workers, initializer=init_worker, initargs=(*parquet_locs, result_queue)), result_queue
+
+
+def process_chunk(month_range: tuple[str, str], db_loc: str, db_name: str, result_queue, batch_size: int=100_000) -> int:
+    first_month, last_month = month_range
+    chunk = "|".join(month_range)
+
+    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0, read_only=True)
+
+    # Stream the raw rows of the month range in batches & enrich every batch in one go (IMD, ward & covid)
+    # (ward by LSOA lookup where the LSOA lies inside one ward, point-in-polygon only for the rest)
+    # Every batch goes to the writer right away, a full queue blocks this worker until the writer catches up
+    n_rows = 0
+    try:
+        for crime_data in db_handler.query_iter(
+            """
+            SELECT
+                *
+            FROM 
+                crime_raw
+            WHERE 
+                month BETWEEN ? AND ?
+            ORDER BY
+                month, crime_id
+            """,
+            chunk_size=batch_size,
+            params=(first_month, last_month)
+        ):
+            enriched = join_tables(crime_data=crime_data, ward_data=_worker_ward_data, imd_data=_worker_imd_data, point_wards=_worker_point_wards, lsoa_wards=_worker_lsoa_wards)
+            enriched = enriched.merge(_worker_covid_data[["month", "stringency_index", "covid_indicator"]], how="left", on="month")
+            result_queue.put(("batch", chunk, enriched[list(CRIME_COLUMNS)], None))
+            n_rows += len(enriched)
+    finally:
+        db_handler.close_connection_db()
+
+    return n_rows
+
+
+def _process_chunk_safe(task: tuple[tuple[str, str], str, str]) -> None:
+    # Report the end of a month range (or its error) to the writer, behind the range's last batch
+    month_range, db_loc, db_name = task
+    chunk = "|".join(month_range)
+
+    t0 = time.time()
+    try:
+        n_rows = process_chunk(month_range, db_loc, db_name, _worker_result_queue)
+        _worker_result_queue.put(("done", chunk, n_rows, time.time() - t0))
+    except Exception as e:
+        _worker_result_queue.put(("failed", chunk, f"{type(e).__name__}: {e}", time.time() - t0))
+
+
+def _next_enrichment_result(result_queue, in_flight: dict, timeout: float=1.0) -> tuple:
+    # Next message from the workers, or a failure for a range whose task broke before it could report
+    while True:
+        try:
+            return result_queue.get(timeout=timeout)
+        except queue.Empty:
+            for chunk, (attempts, result) in in_flight.items():
+                if result.ready() and not result.successful():
+                    try:
+                        result.get()
+                    except Exception as e:
+                        return "failed", chunk, f"{type(e).__name__}: {e}", 0.0
+
+
+def enrich_crime_table(db_handler: DBhandler, pool, result_queue, month_ranges: list[tuple[str, str]], runner: PipelineRunner, stage_name: str="enrichment", max_retries: int=2, max_in_flight: int=8, rows_per_commit: int=500_000) -> int:
+    """
+    Single pass enrichment: every raw crime row is read once from crime_raw and written once, fully enriched,
+    to a new table that then replaces crime. This process is the only writer, the workers only read & join.
+    At most max_in_flight month ranges are handed to the pool at a time and the workers stream their batches
+    through the bounded result_queue, so memory follows the batch size and not the size of crime.
+    Every month range is a checkpointed chunk, marked done in the transaction holding its last batch:
+    a failing range is resubmitted on its own up to max_retries times (its rows are upserted again),
+    and an interrupted run continues with the unfinished ranges.
+    """
+
+    chunks = runner.plan_chunks(stage_name, [f"{first_month}|{last_month}" for first_month, last_month in month_ranges])
+
+    if all(status != "done" for chunk, status in chunks):
+        db_handler.delete_table("crime_enriched")
+    db_handler.create_table("crime_enriched", columns=CRIME_COLUMNS)
+    db_handler.enable_wal_mode()
+
+    pending = deque(chunk for chunk, status in chunks if status != "done")
+    print(f"\n{len(chunks) - len(pending)} of {len(chunks)} month ranges already enriched.\n")
+
+    # Workers read crime_raw from the runner's database
+    def submit(chunk: str, attempts: int) -> None:
+        task = (tuple(chunk.split("|")), db_handler.db_loc, db_handler.db_name)
+        in_flight[chunk] = (attempts, pool.apply_async(_process_chunk_safe, (task,)))
+
+    in_flight = {}
+    rows_written, rows_since_commit = 0, 0
+    t0 = time.time()
+
+    with tqdm(total=len(pending)) as progress:
+        while pending or in_flight:
+            # Refill the submission window as ranges finish
+            while pending and len(in_flight) < max_in_flight:
+                submit(pending.popleft(), 1)
+
+            kind, chunk, payload, seconds = _next_enrichment_result(result_queue, in_flight)
+
+            if kind == "batch":
+                # Batches of ranges running side by side arrive interleaved (each range in month order),
+                # REPLACE overwrites the rows of an earlier, failed attempt at the same range
+                db_handler.insert_dataframe("crime_enriched", payload, loader_pragmas=False, commit=False, on_conflict="REPLACE")
+                rows_since_commit += len(payload)
+
+                if rows_since_commit >= rows_per_commit:
+                    db_handler.con.commit()
+                    rows_since_commit = 0
+                continue
+
+            attempts, result = in_flight.pop(chunk)
+
+            if kind == "failed":
+                if attempts <= max_retries:
+                    # Back into the same window, the ranges already running are not held up
+                    print(f"\nMonth range {chunk} failed ({payload}), retrying ...\n")
+                    submit(chunk, attempts + 1)
+                    continue
+
+                # Keep everything written so far, the next run resumes with the unfinished ranges
+                db_handler.con.commit()
+                runner.record_chunk(stage_name, chunk, "failed", attempts, seconds, payload)
+                raise RuntimeError(f"Month range {chunk} failed after {attempts} attempts: {payload}")
+
+            runner.record_chunk(stage_name, chunk, "done", attempts, seconds, commit=False)
+            rows_written += payload
+            progress.update(1)
+
+    db_handler.con.commit()
+
+    elapsed = time.time() - t0
+    print(f"\nEnriched {rows_written} crimes in {elapsed:.1f}s ({rows_written / max(elapsed, 1e-9):.0f} rows/s)\n")
+
+    # Swap the enriched table in
+    db_handler.delete_table("crime")
+    db_handler.update("ALTER TABLE crime_enriched RENAME TO crime")
+
+    return rows_written
+
+
+#### Pipeline stages ####
+
+def build_force_districts(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # Create table force_districts
+    db_handler.delete_table("force_districts")
+    db_handler.create_table(
+        table_name='force_districts',
+        columns={'force_district_name': 'TEXT PRIMARY KEY',
+                    'multipolygon':'TEXT'
+                    }
+    )
+
+    # Preprocess data for force_districts
+    path_to_district_kml_files = "data/force_kmls/"
+    list_of_district_kmls = os.listdir(path_to_district_kml_files)
+
+    df_polygons_of_districts = []
+    for district_kml in list_of_district_kmls:
+        df_polygons_of_districts.append(parse_kml_multipolygon(parent_path=path_to_district_kml_files, kml_file=district_kml))
+
+    df_districts = pd.concat(df_polygons_of_districts, ignore_index=True)
+    df_districts.multipolygon = df_districts.multipolygon.apply(lambda x: json.dumps(x))
+
+    # Insert data into force_districts
+    db_handler.insert_dataframe("force_districts", data=df_districts)
+
+    return {"districts": len(df_districts)}
+
+
+def ingest_crime(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # Create table for the raw crime data (the enrichment stage builds crime from it)
+    db_handler.create_table(
+        table_name='crime_raw',
+        columns={'crime_id':'TEXT PRIMARY KEY',
+                    'month':'TEXT',
+                    'reported_by':'TEXT',
+                    'falls_within':'TEXT',
+                    'long':'REAL',
+                    'lat':'REAL',
+                    'location':'TEXT',
+                    'lsoa_code':'TEXT',
+                    'crime_type':'TEXT',
+                    'last_outcome_category':'TEXT',
+                    'source_file':'TEXT'
+                    }
+    )
+
+    # Parse new/changed street crime CSVs in parallel, in one pass (rows with & without crime ids), through one writer
+    # (the ingest_manifest table remembers which files are already loaded, failed files are retried on the next run)
+    ingest_report = ingest_new_street_crime_csv_files(db_loc=db_handler.db_loc, db_name=db_handler.db_name)
+    print(ingest_report[ingest_report["action"] != "skipped"])
+
+    failed_files = ingest_report.loc[ingest_report["action"] == "failed", "path"].tolist()
+    if failed_files:
+        raise RuntimeError(f"{len(failed_files)} crime CSV files failed to load: {failed_files}")
+
+    return {
+        "files": ingest_report["action"].value_counts().to_dict(),
+        "rows_inserted": int(ingest_report["rows_inserted"].fillna(0).sum())
+    }
+
+
+def build_lsoa_table(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # Extract & transform lsoa data
+    lsoa_df = combine_all_lsoa_data_files(list_lsoa_data_files())
+
+    lsoa_df = lsoa_df[["lsoa21cd", "lsoa21nm", "geometry"]].rename(columns={
+        "lsoa21cd":"lsoa_code",
+        "lsoa21nm":"lsoa_name"
+    })
+
+    lsoa_df["geometry"] = lsoa_df["geometry"].apply(wkt_dumps)
+
+    # Create lsoa table
+    db_handler.delete_table("lsoa_location")
+    db_handler.create_table("lsoa_location", columns={
+        'lsoa_code':'TEXT PRIMARY KEY',
+        'lsoa_name':'TEXT',
+        'geometry':'TEXT'
+    })
+
+    # Insert LSOA data
+    db_handler.insert_dataframe("lsoa_location", data=pd.DataFrame(lsoa_df))
+
+    # Store pre-projected (EPSG:4326) WKB geometry & bounding boxes next to the WKT
+    add_projected_geometry(db_handler, "lsoa_location", "lsoa_code")
+
+    return {"lsoas": len(lsoa_df)}
+
+
+def build_ward_table(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # Extract & transform ward data
+    ward_df = gpd.read_file(WARD_BOUNDARIES_PATH)
+    ward_df = ward_df[["WD16CD", "WD16NM", "geometry"]].rename(columns={
+        "WD16CD":"ward_code",
+        "WD16NM":"ward_name"
+    })
+    ward_df["geometry"] = ward_df["geometry"].apply(wkt_dumps)
+
+    # Create ward table
+    db_handler.delete_table("ward_location")
+    db_handler.create_table("ward_location", columns={
+        'ward_code':'TEXT PRIMARY KEY',
+        'ward_name':'TEXT',
+        'geometry':'TEXT'
+    })
+
+    # Insert ward data
+    db_handler.insert_dataframe("ward_location", data=pd.DataFrame(ward_df))
+
+    # Store pre-projected (EPSG:4326) WKB geometry & bounding boxes next to the WKT
+    add_projected_geometry(db_handler, "ward_location", "ward_code")
+
+    return {"wards": len(ward_df)}
+
+
+def build_lsoa_ward_table(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # LSOA -> ward mapping from a polygon overlay, crimes in LSOAs inside a single ward skip the spatial join
+    n_single_ward = update_lsoa_ward_lookup(db_handler)
+    n_lsoas = db_handler.con.execute("SELECT COUNT(DISTINCT lsoa_code) FROM lsoa_ward_lookup").fetchone()[0]
+
+    return {"lsoas": n_lsoas, "single_ward_lsoas": n_single_ward}
+
+
+def build_imd_table(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    #Extract & transform IMD data
+    db_handler.delete_table("imd_data")
 
+    imd_df = pd.read_csv(IMD_PATH).reset_index()
+    imd_df = imd_df[["FeatureCode", "Measurement", "Value", "Indices of Deprivation"]].rename(columns={
+        "index":"uuid_imd",
+        "FeatureCode":"feature_code",
+        "Measurement":"measurement",
+        "Value":"value",
+        "Indices of Deprivation":"indices_of_deprivation"
+    })
 
-def process_chunk(offset: int, chunk_size: int, imd_parquet_loc: str, ward_parquet_loc: str, worker: int) -> None:
-    # Load IMD and ward data inside each process from Parquet
-    imd_data = pd.read_parquet(imd_parquet_loc)
-    ward_data = pd.read_parquet(ward_parquet_loc)
+    # Create IMD table
+    db_handler.create_table("imd_data", columns={
+        'uuid_imd':'INTEGER PRIMARY KEY',
+        'feature_code':'TEXT',
+        'measurement':'TEXT',
+        'value':'REAL',
+        'indices_of_deprivation':'TEXT'
+    })
 
-    db_handler = DBhandler(db_loc="../data", db_name="crime_data_UK_v3.db", verbose=0)
-    crime_data = db_handler.query(
-        f"""
-        SELECT
-            *
+    # Insert imd data
+    db_handler.insert_dataframe("imd_data", data=imd_df)
+
+    return {"rows": len(imd_df)}
+
+
+def build_covid_table(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # Covid variables for every month in crime_raw, stored as covid_month for the enrichment stage
+    min_max_month_crimes = db_handler.query(
+        '''
+        SELECT 
+            MIN(month) as min_month, 
+            MAX(month) as max_month
         FROM 
-            crime
-        ORDER BY 
-            crime_id
-        LIMIT 
-            {chunk_size}
-        OFFSET 
-            {offset}
-        """,
-        False
+            crime_raw
+        '''
     )
+    min_month_crime = min_max_month_crimes.loc[0, "min_month"]
+    max_month_crime = min_max_month_crimes.loc[0, "max_month"]
 
-    df_final_temp = join_tables(crime_data=crime_data, ward_data=ward_data, imd_data=imd_data)[[
-        "crime_id", "month", "reported_by", "falls_within", "long", "lat", "location", "lsoa_code", "crime_type", 
-        "last_outcome_category", "average_imd_decile", "ward_code", "covid_indicator", "stringency_index"
-    ]]
+    month_range = pd.date_range(start=min_month_crime, end=max_month_crime, freq="MS")
 
-    sleep = 5
-    while True:
-        try:
-            db_handler.insert_rows("crime_temp", data=df_final_temp.to_dict(orient='records'))
-            print(f"Worker {worker} finished inserting data! Unlocking database ...")
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e).lower():
-                print(f"Database is locked! Worker {worker} will retry in {sleep} seconds")
-                time.sleep(sleep)
-            else:
-                raise
+    month_df = pd.DataFrame({
+        "month": month_range.strftime("%Y-%m"),
+    })
 
-    db_handler.close_connection_db()
+    covid_df = read_and_transform_stringency_data(os.path.join(db_handler.db_loc, "OxCGRT_timeseries_StringencyIndex_v1.csv"))
+
+    final_covid_data = month_df.merge(covid_df, on="month", how="left")
+
+    final_covid_data[["stringency_index", "covid_indicator"]] = final_covid_data[["stringency_index", "covid_indicator"]].fillna(0)
+
+    db_handler.delete_table("covid_month")
+    db_handler.create_table("covid_month", columns={
+        "month":"TEXT PRIMARY KEY",
+        "stringency_index":"REAL",
+        "covid_indicator":"REAL"
+    })
+    db_handler.insert_dataframe("covid_month", data=final_covid_data)
+
+    return {"months": len(final_covid_data)}
+
+
+def build_crime_table(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    # Build crime from crime_raw in one pass (covid, imd data & ward code joined in the workers)
+    cpu_count = psutil.cpu_count(logical=False)
+
+    # Parquet files for the workers (only used on platforms without fork)
+    parquet_locs = tuple(runner.artifact_path("enrichment", f"{name}.parquet") for name in ["imd_data", "ward_data", "point_wards", "lsoa_wards", "covid_data"])
+
+    # Split crime_raw into many small month ranges, workers pull them from the pool's task queue
+    month_ranges = split_month_ranges(db_handler, "crime_raw", n_ranges=16*cpu_count)
+
+    print(f"\nDividing {len(month_ranges)} month ranges over {cpu_count} workers.\n")
+
+    # Load data once for all workers
+    imd_data = db_handler.query("""
+        SELECT * FROM imd_data
+        WHERE measurement LIKE '%Decile%'
+        AND indices_of_deprivation LIKE '%Index of Multiple Deprivation (IMD)%'
+    """, True)
+
+    ward_data = db_handler.query("SELECT ward_code, ward_name, geometry_wkb FROM ward_location", True)
+    covid_data = db_handler.query("SELECT * FROM covid_month")
+    lsoa_wards = db_handler.query("SELECT lsoa_code, ward_code, ward_name, single_ward FROM lsoa_ward_lookup WHERE single_ward = 1")
+
+    # Resolve wards once per distinct coordinate not seen in earlier builds (only in LSOAs straddling a ward boundary)
+    # (the lookup is tied to the ward_location version, new ward boundaries start it over)
+    new_points = update_point_ward_lookup(db_handler, ward_data, get_table_version(db_handler, "ward_location"), crime_table="crime_raw", skip_single_ward_lsoas=True)
+    print(f"\nResolved wards for {new_points} new coordinates.\n")
+    point_wards = db_handler.query("SELECT * FROM point_ward_lookup", True)
+
+    # Workers read & join, this process writes crime_enriched once and swaps it in as crime
+    # (ward geometries & STRtree are built once in this process and shared with the workers)
+    # At most 2 month ranges per worker in flight & 2 enriched batches per worker waiting for the writer
+    pool, result_queue = create_enrichment_pool(cpu_count, imd_data, ward_data, point_wards, lsoa_wards, covid_data, parquet_locs, queue_size=2*cpu_count)
+    with pool:
+        rows_written = enrich_crime_table(db_handler, pool, result_queue, month_ranges, runner, max_in_flight=2*cpu_count)
+
+    # Clean up temporary Parquet files
+    for parquet_loc in parquet_locs:
+        if os.path.exists(parquet_loc):
+            os.remove(parquet_loc)
+
+    return {"rows": rows_written, "month_ranges": len(month_ranges), "new_points": new_points}
+
+
+def build_indexes(db_handler: DBhandler, runner: PipelineRunner) -> dict:
+    #### Covering index on (ward_code, month) for ward lookups & per-ward monthly aggregates ####
+    create_ward_month_index(db_handler)
+
+    #### Ward x month aggregates (rebuilt, crime itself is rebuilt by every enrichment run) ####
+    version = refresh_ward_month_stats(db_handler)
+
+    return {"ward_month_stats_version": version}
+
+
+def build_pipeline(db_handler: DBhandler) -> list[PipelineStage]:
+    covid_path = os.path.join(db_handler.db_loc, "OxCGRT_timeseries_StringencyIndex_v1.csv")
+
+    return [
+        PipelineStage("force_districts", build_force_districts, input_paths=["data/force_kmls/"], output_tables=["force_districts"]),
+        PipelineStage("crime_ingest", ingest_crime, input_paths=["data/crime_data/"], output_tables=["crime_raw"]),
+        PipelineStage("lsoa", build_lsoa_table, input_paths=["data/LB_shp/"], output_tables=["lsoa_location"]),
+        PipelineStage("wards", build_ward_table, input_paths=[WARD_BOUNDARIES_PATH], output_tables=["ward_location"]),
+        PipelineStage("lsoa_wards", build_lsoa_ward_table, input_tables=["lsoa_location", "ward_location"], output_tables=["lsoa_ward_lookup"]),
+        PipelineStage("imd", build_imd_table, input_paths=[IMD_PATH], output_tables=["imd_data"]),
+        PipelineStage("covid", build_covid_table, input_paths=[covid_path], input_tables=["crime_raw"], output_tables=["covid_month"]),
+        PipelineStage("enrichment", build_crime_table, input_tables=["crime_raw", "imd_data", "ward_location", "lsoa_ward_lookup", "covid_month"], output_tables=["crime", "point_ward_lookup"]),
+        PipelineStage("indexing", build_indexes, input_tables=["crime"], output_tables=["ward_month_stats"])
+    ]
 
 
 if __name__ == "__main__":
 
+    # Usage: python main_db.py [stage to force ...]
+    # Stages that are up to date are skipped; after a crash the next run resumes from the failed stage
+    # (the enrichment stage even from its first unfinished month range)
+
     # Establish connection
     db_handler = DBhandler(db_loc="../data", db_name="crime_data_UK_v3.db")
 
-    # # Create table force_districts
-    # db_handler.create_table(
-    #     table_name='force_districts',
-    #     columns={'force_district_name': 'TEXT PRIMARY KEY',
-    #                 'multipolygon':'TEXT'
-    #                 }
-    # )
-
-    # # Preprocess data for force_districts
-    # path_to_district_kml_files = "data/force_kmls/"
-    # list_of_district_kmls = os.listdir(path_to_district_kml_files)
-
-    # df_polygons_of_districts = []
-    # for district_kml in list_of_district_kmls:
-    #     df_polygons_of_districts.append(parse_kml_multipolygon(parent_path=path_to_district_kml_files, kml_file=district_kml))
-
-    # df_districts = pd.concat(df_polygons_of_districts, ignore_index=True)
-    # df_districts.multipolygon = df_districts.multipolygon.apply(lambda x: json.dumps(x))
-
-    # # Insert data into force_districts
-    # db_handler.insert_rows(
-    #     table_name='force_districts',
-    #     data=df_districts.to_dict(orient='records')
-    # )
-
-    # # Create table crime data
-    # db_handler.create_table(
-    #     table_name='crime',
-    #     columns={'crime_id':'TEXT PRIMARY KEY',
-    #                 'month':'TEXT',
-    #                 'reported_by':'TEXT',
-    #                 'falls_within':'TEXT',
-    #                 'long':'REAL',
-    #                 'lat':'REAL',
-    #                 'location':'TEXT',
-    #                 'lsoa_code':'TEXT',
-    #                 'crime_type':'TEXT',
-    #                 'last_outcome_category':'TEXT'
-    #                 }
-    # )
-
-    # for file in tqdm(list_all_street_crime_csv_files()):
-    #     temp_df = extract_and_transform_crime_data(file, True, db_handler.existing_crime_ids)
-
-    #     if not temp_df.empty:
-
-    #         temp_df = temp_df.drop(columns=["LSOA name", "Context"])
-
-    #         temp_df.columns = temp_df.columns.str.strip().str.lower()
-
-    #         temp_df = temp_df.rename(
-    #             columns={
-    #                 "crime id": "crime_id",
-    #                 "month": "month",
-    #                 "reported by": "reported_by",
-    #                 "falls within": "falls_within",
-    #                 "longitude": "long",
-    #                 "latitude": "lat",
-    #                 "location":"location",
-    #                 "lsoa code": "lsoa_code",
-    #                 "crime type":"crime_type",
-    #                 "last outcome category":"last_outcome_category"
-    #             }
-    #         )
-    #         # print(temp_df.head())
-            
-    #         db_handler.insert_rows(
-    #             table_name='crime',
-    #             data=temp_df.to_dict(orient='records')
-    #         )
-        
-    #     else:
-    #         print("Empty dataframe, skipping file ...")
-
-    # print("\nInserted all crime data with crime ids!\n")
-
-    # for file in tqdm(list_all_street_crime_csv_files()):
-    #     temp_df = extract_and_transform_crime_data(file, False, db_handler.existing_crime_ids)
-
-    #     if not temp_df.empty:
-
-    #         temp_df = temp_df.drop(columns=["LSOA name", "Context"])
-
-    #         temp_df.columns = temp_df.columns.str.strip().str.lower()
-
-    #         temp_df = temp_df.rename(
-    #             columns={
-    #                 "crime id": "crime_id",
-    #                 "month": "month",
-    #                 "reported by": "reported_by",
-    #                 "falls within": "falls_within",
-    #                 "longitude": "long",
-    #                 "latitude": "lat",
-    #                 "location":"location",
-    #                 "lsoa code": "lsoa_code",
-    #                 "crime type":"crime_type",
-    #                 "last outcome category":"last_outcome_category"
-    #             }
-    #         )
-            
-    #         db_handler.insert_rows(
-    #             table_name='crime',
-    #             data=temp_df.to_dict(orient='records')
-    #         )
-
-    #     else:
-    #         print("Empty dataframe, skipping this file ...")
-
-    # print("\nInserted all data with generated crime ids!\n")
-
-    # db_handler.create_table("existing_crime_ids", columns={
-    #     "existing_crime_id": "TEXT PRIMARY KEY"
-    # })
-
-    # db_handler.insert_rows("existing_crime_ids", data=[{"existing_crime_id":i} for i in db_handler.existing_crime_ids])
-
-    # # Extract & transform lsoa data
-    # lsoa_df = combine_all_lsoa_data_files(list_lsoa_data_files())
-
-    # lsoa_df = lsoa_df[["lsoa21cd", "lsoa21nm", "geometry"]].rename(columns={
-    #     "lsoa21cd":"lsoa_code",
-    #     "lsoa21nm":"lsoa_name"
-    # })
-
-    # lsoa_df["geometry"] = lsoa_df["geometry"].apply(wkt_dumps)
-
-    # # Create lsoa table
-    # db_handler.create_table("lsoa_location", columns={
-    #     'lsoa_code':'TEXT PRIMARY KEY',
-    #     'lsoa_name':'TEXT',
-    #     'geometry':'TEXT'
-    # })
-
-    # # Insert LSOA data
-    # db_handler.insert_rows("lsoa_location", data=lsoa_df.to_dict(orient='records'))
-
-
-    # # Extract & transform ward data
-    # ward_df = gpd.read_file("data/Wards_December_2016_Boundaries_UK_BFE_2022_-5810284385438997272")
-    # ward_df = ward_df[["WD16CD", "WD16NM", "geometry"]].rename(columns={
-    #     "WD16CD":"ward_code",
-    #     "WD16NM":"ward_name"
-    # })
-    # ward_df["geometry"] = ward_df["geometry"].apply(wkt_dumps)
-
-
-    # # Create ward table
-    # db_handler.create_table("ward_location", columns={
-    #     'ward_code':'TEXT PRIMARY KEY',
-    #     'ward_name':'TEXT',
-    #     'geometry':'TEXT'
-    # })
-
-    # # Insert ward data
-    # db_handler.insert_rows("ward_location", data=ward_df.to_dict(orient="records"))
-
-    # #Extract & transform IMD data
-
-    # db_handler.delete_table("imd_data")
-
-    # imd_df = pd.read_csv("data/imd2019lsoa.csv").reset_index()
-    # imd_df = imd_df[["FeatureCode", "Measurement", "Value", "Indices of Deprivation"]].rename(columns={
-    #     "index":"uuid_imd",
-    #     "FeatureCode":"feature_code",
-    #     "Measurement":"measurement",
-    #     "Value":"value",
-    #     "Indices of Deprivation":"indices_of_deprivation"
-    # })
-
-    # # Create IMD table
-    # db_handler.create_table("imd_data", columns={
-    #     'uuid_imd':'INTEGER PRIMARY KEY',
-    #     'feature_code':'TEXT',
-    #     'measurement':'TEXT',
-    #     'value':'REAL',
-    #     'indices_of_deprivation':'TEXT'
-    # })
-
-    # # Insert imd data
-    # db_handler.insert_rows("imd_data", data=imd_df.to_dict(orient="records"))
-
-
-    # #### Add covid variables ####
-
-    # db_handler.update(
-    #     '''
-    #     ALTER TABLE crime
-    #     ADD COLUMN stringency_index REAL
-    #     ''')
-    # db_handler.update(
-    #     '''
-    #     ALTER TABLE crime
-    #     ADD COLUMN covid_indicator REAL
-    #     '''
-    # )
-    
-    # min_max_month_crimes = db_handler.query(
-    #     '''
-    #     SELECT 
-    #         MIN(month) as min_month, 
-    #         MAX(month) as max_month
-    #     FROM 
-    #         crime
-    #     '''
-    # )
-    # min_month_crime = min_max_month_crimes.loc[0, "min_month"]
-    # max_month_crime = min_max_month_crimes.loc[0, "max_month"]
-
-    # month_range = pd.date_range(start=min_month_crime, end=max_month_crime, freq="MS")
-
-    # month_df = pd.DataFrame({
-    #     "month": month_range.strftime("%Y-%m"),
-    # })
-
-    # covid_df = read_and_transform_stringency_data(os.path.join(db_handler.db_loc, "OxCGRT_timeseries_StringencyIndex_v1.csv"))
-
-    # final_covid_data = month_df.merge(covid_df, on="month", how="left")
-
-    # final_covid_data[["stringency_index", "covid_indicator"]] = final_covid_data[["stringency_index", "covid_indicator"]].fillna(0)
-
-    # # Create temp covid table
-    # db_handler.create_table("temp_covid_table", columns={
-    #     "month":"TEXT PRIMARY KEY",
-    #     "stringency_index":"REAL",
-    #     "covid_indicator":"REAL"
-    # })
-
-    # db_handler.insert_rows("temp_covid_table", data=final_covid_data.to_dict(orient="records"))
-
-    # db_handler.update(
-    #     '''
-    #     UPDATE crime
-    #     SET stringency_index = (
-    #         SELECT temp.stringency_index
-    #         FROM temp_covid_table temp
-    #         WHERE temp.month = crime.month
-    #     ),
-    #     covid_indicator = (
-    #         SELECT temp.covid_indicator
-    #         FROM temp_covid_table temp
-    #         WHERE temp.month = crime.month
-    #     )
-    #     ''')
-    
-    # db_handler.delete_table('temp_covid_table')
-
-    # #### Update crime table, such that it contains imd data & ward code ####
-    # cpu_count = psutil.cpu_count(logical=False)
-
-    # # Temp paths for parquet files
-    # imd_parquet = os.path.join(db_handler.db_loc, "imd_data_temp.parquet")
-    # ward_parquet = os.path.join(db_handler.db_loc, "ward_data_temp.parquet")
-
-    # # Load data once and save to Parquet for multiprocessing
-    # crime_count = db_handler.query("SELECT COUNT(crime_id) as crimes FROM crime", True).loc[0, "crimes"]
-    # chunk_size = int(crime_count / cpu_count)+1
-
-    # print(f"\nDividing computational work over {cpu_count} workers.\n")
-    # offset_per_agent = [i for i in range(0, crime_count, chunk_size)]
-
-    # imd_data = db_handler.query("""
-    #     SELECT * FROM imd_data
-    #     WHERE measurement LIKE '%Decile%'
-    #     AND indices_of_deprivation LIKE '%Index of Multiple Deprivation (IMD)%'
-    # """, True)
-    # imd_data.to_parquet(imd_parquet, index=False)
-
-    # ward_data = db_handler.query("SELECT * FROM ward_location", True)
-    # ward_data.to_parquet(ward_parquet, index=False)
-
-    # db_handler.delete_table("crime_temp")
-
-    # db_handler.create_table("crime_temp", columns={
-    #     'crime_id':'TEXT PRIMARY KEY',
-    #     'month':'TEXT',
-    #     'reported_by':'TEXT',
-    #     'falls_within':'TEXT',
-    #     'long':'REAL',
-    #     'lat':'REAL',
-    #     'location':'TEXT',
-    #     'lsoa_code':'TEXT',
-    #     'crime_type':'TEXT',
-    #     'last_outcome_category':'TEXT',
-    #     'average_imd_decile': 'REAL',
-    #     'ward_code': 'TEXT',
-    #     'covid_indicator': 'REAL',
-    #     'stringency_index': 'REAL'
-    # })
-
-    # # Use Pool with starmap and arguments (offset, chunk_size)
-    # with Pool(cpu_count) as pool:
-    #     pool.starmap(process_chunk, [(offset, chunk_size, imd_parquet, ward_parquet, worker) for worker, offset in 
-    #                                  enumerate(offset_per_agent)])
-
-    # # Clean up temporary Parquet files
-    # if os.path.exists(imd_parquet):
-    #     os.remove(imd_parquet)
-    # if os.path.exists(ward_parquet):
-    #     os.remove(ward_parquet)
-
-    # #### Clean up database ####
-    # db_handler.delete_table("crime")
-    # db_handler.create_table("crime", columns={
-    #     'crime_id':'TEXT PRIMARY KEY',
-    #     'month':'TEXT',
-    #     'reported_by':'TEXT',
-    #     'falls_within':'TEXT',
-    #     'long':'REAL',
-    #     'lat':'REAL',
-    #     'location':'TEXT',
-    #     'lsoa_code':'TEXT',
-    #     'crime_type':'TEXT',
-    #     'last_outcome_category':'TEXT',
-    #     'average_imd_decile': 'REAL',
-    #     'ward_code': 'TEXT',
-    #     'covid_indicator': 'REAL',
-    #     'stringency_index': 'REAL'    
-    # })
-    # db_handler.update(
-    #     """
-    #     INSERT INTO crime
-    #     SELECT * 
-    #     FROM crime_temp 
-    #     ORDER BY month ASC, crime_id ASC
-    #     """)
-    # db_handler.delete_table("crime_temp")
-
-    # #### Create index on ward_code ####
-    # db_handler.update("CREATE INDEX IF NOT EXISTS idx_crime_ward_code ON crime(ward_code)")
+    runner = PipelineRunner(db_handler, build_pipeline(db_handler))
+    timings = runner.run(force=sys.argv[1:])
+
+    print("\nStage timings:")
+    print(timings.to_string(index=False))
+    print()
 
     # Close Connection
     db_handler.close_connection_db()
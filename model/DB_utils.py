@@ -10,7 +10,14 @@ import xml.etree.ElementTree as ET
 import re
 from tqdm import tqdm
 import secrets
+import hashlib
+import binascii
 import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from multiprocessing import Pool, Process, Manager, TimeoutError as PoolTimeoutError
+import queue
 
 
 
@@ -78,35 +85,500 @@ def generate_SHA256_key(existing_keys: set[str]) -> str:
             return new_key
 
 
-def extract_and_transform_crime_data(csv_path: str, only_with_crime_ids: bool, existing_crime_ids: set) -> pd.DataFrame:
-    
-    df = pd.read_csv(csv_path)
+# Row content that identifies a crime without a Crime ID
+CRIME_ID_CONTENT_COLUMNS = ["month", "long", "lat", "lsoa_code", "crime_type", "last_outcome_category"]
+
+# Seeds of the four 64 bit lanes, 4 x 64 bits gives a 256 bit id (same length as the SHA256 keys)
+CRIME_ID_LANE_SEEDS = np.array([0x243F6A8885A308D3, 0x13198A2E03707344, 0xA4093822299F31D0, 0x082EFA98EC4E6C89], dtype=np.uint64)
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer, vectorized over uint64 arrays
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_column(values: pd.Series) -> np.ndarray:
+    # Numbers are hashed straight from their bits, text is factorized first so every distinct value is hashed once
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return pd.util.hash_pandas_object(pd.Series(uniques), index=False).to_numpy(dtype=np.uint64)[codes]
+
+
+def generate_crime_ids(df: pd.DataFrame, content_columns: list[str]= CRIME_ID_CONTENT_COLUMNS) -> pd.Series:
+    """
+    Deterministic 64 character hex ids from row content, computed for the whole frame at once.
+    Identical rows in one file are told apart by their ordinal among the duplicates, so re-ingesting
+    the same file gives the same ids.
+    Columns are hashed in their own dtype and combined with vectorized integer mixing; the ids end up in
+    an Arrow string array on top of one hex buffer, no Python string is made per id.
+    """
+
+    import pyarrow as pa
+
+    n_rows = len(df)
+    lanes = [np.full(n_rows, seed, dtype=np.uint64) for seed in CRIME_ID_LANE_SEEDS]
+
+    with np.errstate(over="ignore"):
+        for column_number, column in enumerate(content_columns):
+            value_hashes = _hash_column(df[column]) ^ (np.uint64(column_number + 1) * np.uint64(0x9E3779B97F4A7C15))
+
+            for lane, seed in enumerate(CRIME_ID_LANE_SEEDS):
+                lanes[lane] = _mix64((lanes[lane] ^ value_hashes) + seed)
+
+        # Ordinal among rows with identical content (grouping on the first lane is enough), 0 for unique rows
+        duplicate_ordinal = np.zeros(n_rows, dtype=np.uint64)
+        duplicated = pd.Series(lanes[0]).duplicated(keep=False).to_numpy()
+        if duplicated.any():
+            duplicate_ordinal[duplicated] = pd.Series(lanes[0][duplicated]).groupby(lanes[0][duplicated]).cumcount().to_numpy(dtype=np.uint64)
+
+        for lane, seed in enumerate(CRIME_ID_LANE_SEEDS):
+            lanes[lane] = _mix64((lanes[lane] ^ duplicate_ordinal) + seed)
+
+    # Hex-encode all digests in one go, every id is a 64 byte slice of the buffer
+    digests = np.column_stack(lanes).astype(">u8")
+    hex_buffer = binascii.hexlify(digests.tobytes())
+    offsets = np.arange(0, 64 * (n_rows + 1), 64, dtype=np.int64)
+    crime_ids = pa.LargeStringArray.from_buffers(n_rows, pa.py_buffer(offsets), pa.py_buffer(hex_buffer))
+
+    return pd.Series(crime_ids, index=df.index, dtype="str")
+
+
+class CrimeIdIndex:
+    """
+    Compact membership structure for crime ids: a sorted uint64 array of 64 bit id digests (8 bytes per id
+    instead of a ~130 byte Python string in a set), behind a Bloom filter so most unknown ids are rejected
+    without a binary search. Both arrays can be saved as .npy files and memory-mapped on the next run.
+
+    False positives: a lookup can only wrongly say an id exists (Bloom filter hit plus a 64 bit digest collision,
+    roughly n^2 / 2^65 over n ids, ~1e-4 at 50M ids). It never misses an id that was added. Callers that must not
+    drop a new crime verify positives against the (raw) crime table with confirm_in_db().
+    """
+
+    def __init__(self, digests: np.ndarray | None= None, bloom_bits: int= 1 << 20, n_hashes: int= 7) -> None:
+        self.digests = np.unique(digests).astype(np.uint64) if digests is not None else np.empty(0, dtype=np.uint64)
+        self.n_hashes = n_hashes
+
+        # ~10 bits per id keeps the Bloom false positive rate around 1%
+        bloom_bits = max(bloom_bits, 10 * len(self.digests))
+        self.bloom = np.zeros((bloom_bits + 7) // 8, dtype=np.uint8)
+        self._add_to_bloom(self.digests)
+
+
+    @staticmethod
+    def digest(crime_ids) -> np.ndarray:
+        return pd.util.hash_array(np.asarray(crime_ids, dtype=object)).astype(np.uint64)
 
-    if only_with_crime_ids:
-        df_filtered = df[pd.notna(df["Crime ID"])]
 
-        temp_existing_crime_ids = df_filtered["Crime ID"].to_list()
+    def _bloom_positions(self, digests: np.ndarray) -> np.ndarray:
+        # Double hashing: position_i = h1 + i * h2 (mod number of bits)
+        n_bits = np.uint64(len(self.bloom) * 8)
+        h1 = digests & np.uint64(0xFFFFFFFF)
+        h2 = (digests >> np.uint64(32)) | np.uint64(1)
 
-        existing_crime_ids.update(temp_existing_crime_ids)
+        with np.errstate(over="ignore"):
+            return np.stack([(h1 + np.uint64(i) * h2) % n_bits for i in range(self.n_hashes)])
 
-        if len(df_filtered) <= 0:
-            print("All crime data misses crime_id values!")
 
-        return df_filtered
+    def _add_to_bloom(self, digests: np.ndarray) -> None:
+        if len(digests) == 0:
+            return
+
+        positions = self._bloom_positions(digests).ravel()
+        np.bitwise_or.at(self.bloom, positions >> np.uint64(3), (np.uint64(1) << (positions & np.uint64(7))).astype(np.uint8))
+
+
+    def _maybe_contains(self, digests: np.ndarray) -> np.ndarray:
+        positions = self._bloom_positions(digests)
+        bits = (self.bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+
+        return bits.all(axis=0)
+
+
+    def contains_many(self, crime_ids) -> np.ndarray:
+        digests = self.digest(crime_ids)
+        found = self._maybe_contains(digests)
+
+        # Binary search only for Bloom filter hits
+        if found.any() and len(self.digests) > 0:
+            candidates = digests[found]
+            positions = np.searchsorted(self.digests, candidates).clip(max=len(self.digests) - 1)
+            found[found] = self.digests[positions] == candidates
+
+        return found
+
+
+    def __contains__(self, crime_id: str) -> bool:
+        return bool(self.contains_many([crime_id])[0])
+
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+
+    def update(self, crime_ids) -> None:
+        self.add_digests(self.digest(crime_ids))
+
+
+    def add(self, crime_id: str) -> None:
+        self.update([crime_id])
+
+
+    def add_digests(self, digests: np.ndarray) -> None:
+        if len(digests) == 0:
+            return
+
+        # Memory-mapped arrays are read-only
+        if not self.bloom.flags.writeable:
+            self.bloom = np.array(self.bloom)
+
+        self.digests = np.union1d(self.digests, digests).astype(np.uint64)
+
+        # Grow the Bloom filter once it's too full to be useful
+        if len(self.bloom) * 8 < 10 * len(self.digests):
+            self.bloom = np.zeros((20 * len(self.digests) + 7) // 8, dtype=np.uint8)
+            self._add_to_bloom(self.digests)
+        else:
+            self._add_to_bloom(np.asarray(digests, dtype=np.uint64))
+
+
+    # Ids of crime_ids (all flagged as present) that really are in the crime table
+    @staticmethod
+    def confirm_in_db(db_handler, crime_ids: list[str], batch_size: int=500, table_name: str="crime_raw") -> set[str]:
+        confirmed = set()
+        for start in range(0, len(crime_ids), batch_size):
+            batch = list(crime_ids[start:start + batch_size])
+            placeholders = ", ".join(["?"] * len(batch))
+            rows = db_handler.con.execute(f"SELECT crime_id FROM {table_name} WHERE crime_id IN ({placeholders})", batch).fetchall()
+            confirmed.update(row[0] for row in rows)
+
+        return confirmed
+
+
+    def save(self, path_prefix: str) -> None:
+        np.save(f"{path_prefix}.digests.npy", self.digests)
+        np.save(f"{path_prefix}.bloom.npy", self.bloom)
+        with open(f"{path_prefix}.json", "w") as f:
+            json.dump({"n_hashes": self.n_hashes, "n_ids": len(self.digests)}, f)
+
+
+    @classmethod
+    def load(cls, path_prefix: str, mmap: bool=True) -> "CrimeIdIndex":
+        if not os.path.exists(f"{path_prefix}.json"):
+            return cls()
+
+        with open(f"{path_prefix}.json") as f:
+            params = json.load(f)
+
+        mmap_mode = "r" if mmap else None
+        index = cls.__new__(cls)
+        index.n_hashes = params["n_hashes"]
+        index.digests = np.load(f"{path_prefix}.digests.npy", mmap_mode=mmap_mode)
+        index.bloom = np.load(f"{path_prefix}.bloom.npy", mmap_mode=mmap_mode)
+
+        return index
+
+
+    @classmethod
+    def from_db(cls, db_handler, chunk_size: int=1_000_000, table_name: str="crime_raw") -> "CrimeIdIndex":
+        digests = [
+            cls.digest(chunk["crime_id"])
+            for chunk in db_handler.query_iter(f"SELECT crime_id FROM {table_name}", chunk_size=chunk_size)
+        ]
+
+        return cls(np.concatenate(digests) if digests else None)
+
+
+# Street crime CSV columns we keep, with their names in the crime table
+CRIME_CSV_COLUMNS = {
+    "Crime ID": "crime_id",
+    "Month": "month",
+    "Reported by": "reported_by",
+    "Falls within": "falls_within",
+    "Longitude": "long",
+    "Latitude": "lat",
+    "Location": "location",
+    "LSOA code": "lsoa_code",
+    "Crime type": "crime_type",
+    "Last outcome category": "last_outcome_category"
+}
+
+CRIME_CSV_DTYPES = {
+    "Crime ID": str,
+    "Month": str,
+    "Reported by": str,
+    "Falls within": str,
+    "Longitude": "float64",
+    "Latitude": "float64",
+    "Location": str,
+    "LSOA code": str,
+    "Crime type": str,
+    "Last outcome category": str
+}
+
+
+def read_street_crime_csv(csv_path: str) -> pd.DataFrame:
+    """
+    Single pass over one street crime CSV: explicit dtypes, only the columns we store, pyarrow parser.
+    Rows without a Crime ID get a content-based key (see generate_crime_ids), so both kinds of rows
+    come out of the same read.
+    """
+
+    df = pd.read_csv(csv_path, usecols=list(CRIME_CSV_COLUMNS), dtype=CRIME_CSV_DTYPES, engine="pyarrow")
+    df = df.rename(columns=CRIME_CSV_COLUMNS)[list(CRIME_CSV_COLUMNS.values())]
+
+    missing_ids = df["crime_id"].isna()
+    if missing_ids.any():
+        df.loc[missing_ids, "crime_id"] = generate_crime_ids(df[missing_ids])
+
+    return df
 
-    else:
 
-        df_filtered = df[pd.isna(df["Crime ID"])].copy()
+# Crime id index of this (worker) process, memory-mapped once
+_worker_crime_id_index = None
 
-        number_of_new_keys_needed = len(df_filtered)
-        new_keys = [generate_SHA256_key(existing_keys=existing_crime_ids) for _ in range(number_of_new_keys_needed)]
 
-        df_filtered["Crime ID"] = new_keys
+def _drop_existing_crimes(df: pd.DataFrame, id_index_path: str, db_loc: str, db_name: str, table_name: str) -> pd.DataFrame:
+    global _worker_crime_id_index
 
-        if len(df_filtered) <= 0:
-            print("All crime data had crime id values!")
+    if _worker_crime_id_index is None:
+        _worker_crime_id_index = CrimeIdIndex.load(id_index_path, mmap=True)
 
-        return df_filtered
+    maybe_existing = _worker_crime_id_index.contains_many(df["crime_id"])
+    if not maybe_existing.any():
+        return df
+
+    # Index hits can be false positives, only drop ids the crime table confirms
+    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0, read_only=True)
+    confirmed = CrimeIdIndex.confirm_in_db(db_handler, df.loc[maybe_existing, "crime_id"].tolist(), table_name=table_name)
+    db_handler.close_connection_db()
+
+    return df[~df["crime_id"].isin(confirmed)]
+
+
+def _ingest_csv_worker(args: tuple) -> tuple[str, int, str | None, np.ndarray]:
+    csv_path, write_queue, id_index_path, db_loc, db_name, table_name = args
+
+    try:
+        df = read_street_crime_csv(csv_path)
+        n_rows = len(df)
+
+        # Rows remember their file, so a changed file can replace exactly its own rows
+        df["source_file"] = csv_path
+
+        if id_index_path is not None and not df.empty:
+            df = _drop_existing_crimes(df, id_index_path, db_loc, db_name, table_name)
+    except Exception as e:
+        # One bad file shouldn't stop the others, the caller records it
+        return csv_path, 0, repr(e), np.empty(0, dtype=np.uint64)
+
+    if not df.empty:
+        # Tag the batch with its file, so the writer can count inserted rows per file
+        write_queue.put((csv_path, df))
+
+    return csv_path, n_rows, None, CrimeIdIndex.digest(df["crime_id"])
+
+
+def _put_while_alive(write_queue, item, writer: Process, timeout: float=1.0) -> None:
+    # Blocking put on the bounded write queue that gives up once the writer process is gone
+    while True:
+        if not writer.is_alive():
+            raise RuntimeError(f"Writer process died (exit code {writer.exitcode})")
+        try:
+            write_queue.put(item, timeout=timeout)
+            return
+        except queue.Full:
+            continue
+
+
+def _next_while_alive(results, writer: Process, timeout: float=1.0):
+    # Next pool result, but stop waiting once the writer is gone (workers then block on the full queue for good)
+    while True:
+        if not writer.is_alive():
+            raise RuntimeError(f"Writer process died (exit code {writer.exitcode})")
+        try:
+            return results.next(timeout=timeout)
+        except PoolTimeoutError:
+            continue
+
+
+def ingest_street_crime_csv_files(csv_paths: list[str], db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', table_name: str= 'crime_raw', n_workers: int | None= None, id_index_path: str | None= None) -> dict:
+    """
+    Parses the CSVs in a process pool and streams the frames to one writer process (see run_single_writer).
+    Every row is tagged with its file (source_file) and upserted, a crime id that is loaded again gets the new content.
+    With id_index_path, workers drop crimes already in the database using the memory-mapped CrimeIdIndex,
+    and the index is extended with the new ids afterwards.
+    Returns rows read & inserted per file, files that failed to parse and the writer's throughput.
+    If the writer dies, the pool is terminated and a RuntimeError raised (instead of waiting on the queue forever).
+    """
+
+    n_workers = n_workers or os.cpu_count()
+
+    if id_index_path is not None and not os.path.exists(f"{id_index_path}.json"):
+        db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
+        CrimeIdIndex.from_db(db_handler, table_name=table_name).save(id_index_path)
+        db_handler.close_connection_db()
+
+    manager = Manager()
+    write_queue = manager.Queue(maxsize=2*n_workers)
+    writer_stats_queue = manager.Queue()
+
+    writer = Process(target=run_single_writer, args=(write_queue, table_name, db_loc, db_name, 500_000, writer_stats_queue, "REPLACE"))
+    writer.start()
+
+    rows_per_file = {}
+    failed_files = {}
+    new_digests = []
+    t0 = time.time()
+    try:
+        # Leaving the with block terminates the pool, also when the writer died
+        with Pool(n_workers) as pool:
+            worker_args = [(csv_path, write_queue, id_index_path, db_loc, db_name, table_name) for csv_path in csv_paths]
+            results = pool.imap_unordered(_ingest_csv_worker, worker_args)
+            for _ in tqdm(range(len(csv_paths))):
+                csv_path, n_rows, error, digests = _next_while_alive(results, writer)
+                if error is not None:
+                    failed_files[csv_path] = error
+                else:
+                    rows_per_file[csv_path] = n_rows
+                    new_digests.append(digests)
+    finally:
+        if writer.is_alive():
+            _put_while_alive(write_queue, None, writer)
+        writer.join()
+
+        if writer.exitcode != 0:
+            manager.shutdown()
+            raise RuntimeError(f"Writer process failed with exit code {writer.exitcode}")
+
+    writer_stats = writer_stats_queue.get()
+    manager.shutdown()
+
+    if id_index_path is not None and new_digests:
+        crime_id_index = CrimeIdIndex.load(id_index_path, mmap=False)
+        crime_id_index.add_digests(np.concatenate(new_digests))
+        crime_id_index.save(id_index_path)
+
+    print(f"\nIngested {sum(rows_per_file.values())} rows from {len(rows_per_file)} files in {time.time()-t0:.2f}s using {n_workers} workers.\n")
+
+    return {
+        "rows_per_file": rows_per_file,
+        "rows_inserted_per_file": writer_stats.pop("rows_inserted_per_source"),
+        "failed_files": failed_files,
+        "writer": writer_stats
+    }
+
+
+def file_sha256(path: str, block_size: int=1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+def ingest_new_street_crime_csv_files(parent_path: str= "data/crime_data/", db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', table_name: str= 'crime_raw', n_workers: int | None= None) -> pd.DataFrame:
+    """
+    Incremental crime ingest driven by the ingest_manifest table (path, size, mtime, content hash, row counts, status).
+    Files whose size & mtime are unchanged and that loaded fine are skipped without reading them; files with a new
+    size/mtime are hashed and only reloaded if the content changed. A changed (or earlier failed) file replaces its rows:
+    crime_raw rows are tagged with their source_file, the file's previous rows are deleted before it is loaded again.
+    Rows land in the raw table (crime_raw), the enrichment stage builds crime from it.
+    Returns what happened to every file.
+    """
+
+    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
+    db_handler.create_table("ingest_manifest", columns={
+        "path": "TEXT PRIMARY KEY",
+        "size": "INTEGER",
+        "mtime": "REAL",
+        "content_hash": "TEXT",
+        "rows_read": "INTEGER",
+        "rows_inserted": "INTEGER",
+        "status": "TEXT",
+        "error": "TEXT",
+        "loaded_at": "TEXT"
+    })
+
+    # Raw tables from before the source_file column get it (their old rows can't be attributed to a file)
+    existing_columns = [row[1] for row in db_handler.con.execute(f"PRAGMA table_info({table_name})").fetchall()]
+    if existing_columns and "source_file" not in existing_columns:
+        db_handler.update(f"ALTER TABLE {table_name} ADD COLUMN source_file TEXT")
+    if existing_columns:
+        db_handler.update(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_source_file ON {table_name}(source_file)")
+
+    manifest = db_handler.query("SELECT path, size, mtime, content_hash, status FROM ingest_manifest").set_index("path")
+
+    to_load = {}
+    report = []
+    for csv_path in list_all_street_crime_csv_files(parent_path):
+        file_stat = os.stat(csv_path)
+        entry = manifest.loc[csv_path] if csv_path in manifest.index else None
+
+        if entry is not None and entry["status"] == "loaded" and entry["size"] == file_stat.st_size and entry["mtime"] == file_stat.st_mtime:
+            report.append({"path": csv_path, "action": "skipped"})
+            continue
+
+        content_hash = file_sha256(csv_path)
+
+        if entry is not None and entry["status"] == "loaded" and entry["content_hash"] == content_hash:
+            # Touched but not changed
+            db_handler.update("UPDATE ingest_manifest SET size = ?, mtime = ? WHERE path = ?", params=(file_stat.st_size, file_stat.st_mtime, csv_path))
+            report.append({"path": csv_path, "action": "skipped"})
+            continue
+
+        to_load[csv_path] = (file_stat.st_size, file_stat.st_mtime, content_hash, "new" if entry is None else "changed")
+
+    if to_load:
+        # Previous rows of the files go in the same transaction that marks them as loading, so an interrupted
+        # load leaves the files 'loading' (reloaded next run) and never old & new rows side by side
+        db_handler.con.executemany(
+            "INSERT INTO ingest_manifest (path, status) VALUES (?, 'loading') ON CONFLICT(path) DO UPDATE SET status = 'loading'",
+            [(csv_path,) for csv_path in to_load]
+        )
+        if existing_columns:
+            db_handler.con.executemany(f"DELETE FROM {table_name} WHERE source_file = ?", [(csv_path,) for csv_path in to_load])
+        db_handler.con.commit()
+
+        id_index_path = os.path.join(db_handler.db_loc, f"{db_name}.crime_ids")
+        results = ingest_street_crime_csv_files(list(to_load), db_loc=db_loc, db_name=db_name, table_name=table_name, n_workers=n_workers, id_index_path=id_index_path)
+
+        for csv_path, (size, mtime, content_hash, action) in to_load.items():
+            error = results["failed_files"].get(csv_path)
+            db_handler.update(
+                """
+                UPDATE ingest_manifest
+                SET size = ?, mtime = ?, content_hash = ?, rows_read = ?, rows_inserted = ?, status = ?, error = ?, loaded_at = datetime('now')
+                WHERE path = ?
+                """,
+                params=(
+                    size, mtime, content_hash,
+                    results["rows_per_file"].get(csv_path, 0),
+                    results["rows_inserted_per_file"].get(csv_path, 0),
+                    "failed" if error else "loaded",
+                    error,
+                    csv_path
+                )
+            )
+            report.append({
+                "path": csv_path,
+                "action": "failed" if error else action,
+                "rows_read": results["rows_per_file"].get(csv_path, 0),
+                "rows_inserted": results["rows_inserted_per_file"].get(csv_path, 0)
+            })
+
+    db_handler.close_connection_db()
+
+    report = pd.DataFrame(report, columns=["path", "action", "rows_read", "rows_inserted"])
+    print("\nIngest summary:")
+    print(report["action"].value_counts().to_string())
+    print()
+
+    return report
 
 
 def list_lsoa_data_files(parent_path: str= "data/LB_shp/") -> list[str]:
@@ -155,11 +627,123 @@ def read_and_transform_stringency_data(path: str)-> pd.DataFrame:
     return df
 
 
+class QueryProfiler:
+    """
+    Collects per-statement timings for DBhandler.query / query_iter / update.
+    Statements are keyed by their whitespace-normalized text. For every distinct statement the
+    EXPLAIN QUERY PLAN is captured once, and wall times are aggregated into a histogram.
+    Any object with the same record() signature can be plugged into a DBhandler instead.
+    """
+
+    # Upper bounds of the wall time histogram buckets, in milliseconds
+    bucket_bounds_ms = [1, 5, 10, 50, 100, 500, 1_000, 5_000, 30_000, float("inf")]
+
+    def __init__(self, capture_query_plan: bool=True) -> None:
+        self.capture_query_plan = capture_query_plan
+        self.statements = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def normalize(query_txt: str) -> str:
+        return " ".join(query_txt.split())
+
+
+    def record(self, con: sqlite3.Connection, query_txt: str, seconds: float, rows: int, n_bytes: int=0, params=None) -> None:
+        statement = self.normalize(query_txt)
+
+        with self._lock:
+            stats = self.statements.get(statement)
+            is_new = stats is None
+
+            if is_new:
+                stats = {
+                    "calls": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "rows": 0,
+                    "bytes": 0,
+                    "histogram_ms": [0] * len(self.bucket_bounds_ms),
+                    "query_plan": None
+                }
+                self.statements[statement] = stats
+
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["rows"] += max(rows, 0)
+            stats["bytes"] += int(n_bytes)
+
+            elapsed_ms = seconds * 1000
+            for i, bound in enumerate(self.bucket_bounds_ms):
+                if elapsed_ms <= bound:
+                    stats["histogram_ms"][i] += 1
+                    break
+
+        # Plan once per distinct statement (after running it, so temp tables etc. exist)
+        if is_new and self.capture_query_plan:
+            stats["query_plan"] = self.explain(con, query_txt, params)
+
+
+    @staticmethod
+    def explain(con: sqlite3.Connection, query_txt: str, params=None) -> list[str] | None:
+        try:
+            plan = con.execute(f"EXPLAIN QUERY PLAN {query_txt}", params or ()).fetchall()
+        except sqlite3.Error:
+            # e.g. DDL, or the statement dropped its own table
+            return None
+
+        return [row[-1] for row in plan]
+
+
+    # Statements sorted by total time spent, with full scans flagged
+    def summary(self) -> pd.DataFrame:
+        with self._lock:
+            rows = []
+            for statement, stats in self.statements.items():
+                plan = stats["query_plan"] or []
+                rows.append({
+                    "statement": statement,
+                    "calls": stats["calls"],
+                    "total_seconds": stats["total_seconds"],
+                    "mean_seconds": stats["total_seconds"] / stats["calls"],
+                    "max_seconds": stats["max_seconds"],
+                    "rows": stats["rows"],
+                    "bytes": stats["bytes"],
+                    "full_scan": any(step.startswith("SCAN") and "USING" not in step and "CONSTANT ROW" not in step for step in plan),
+                    "temp_b_tree": any("TEMP B-TREE" in step for step in plan)
+                })
+
+        columns = ["statement", "calls", "total_seconds", "mean_seconds", "max_seconds", "rows", "bytes", "full_scan", "temp_b_tree"]
+        return pd.DataFrame(rows, columns=columns).sort_values("total_seconds", ascending=False, ignore_index=True)
+
+
+    def to_json(self, path: str) -> None:
+        with self._lock:
+            report = {
+                "bucket_bounds_ms": [str(bound) if bound == float("inf") else bound for bound in self.bucket_bounds_ms],
+                "statements": self.statements
+            }
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statements = {}
+
+
 class DBhandler:
 
-    def __init__(self, db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', verbose: int=1) -> None:
+    def __init__(self, db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', verbose: int=1, read_only: bool=False, profiler: QueryProfiler | None=None, statement_cache_size: int=128) -> None:
         
-        self.existing_crime_ids = set()
+        self.profiler = profiler
+
+        # Mirrors sqlite3's own LRU statement cache (keyed on SQL text), which doesn't report hits itself
+        self.statement_cache_size = statement_cache_size
+        self._statement_lru = OrderedDict()
+        self._statement_cache_hits = 0
+        self._statement_cache_misses = 0
 
         base_dir = os.path.dirname(os.path.abspath(__file__))
         self.db_loc = os.path.abspath(os.path.join(base_dir, db_loc))
@@ -167,20 +751,30 @@ class DBhandler:
         self.db_path = os.path.join(self.db_loc, self.db_name)
 
         self.verbose = verbose
+        self.read_only = read_only
 
-        if not os.path.exists(self.db_path):
+        if self.read_only:
+            # Read-only connections never create the database
+            if not os.path.exists(self.db_path):
+                raise ValueError(f"\nDatabase not found at {self.db_path}!\n")
+
+            self.con = self._connect()
+            if self.verbose==1:
+                print("\nEstablished read-only connection with database!\n")
+
+        elif not os.path.exists(self.db_path):
             if self.verbose==1:
                 print("\nDatabase not found! Creating new database ...\n")
 
             try:
-                self.con = sqlite3.connect(self.db_path)
+                self.con = self._connect()
                 if self.verbose==1:
                     print(f"\nDatabase created at {self.db_path}\n")
             except:
                 raise ValueError("\nInvalid database location!\n")
             
         else:
-            self.con = sqlite3.connect(self.db_path)
+            self.con = self._connect()
             if self.verbose==1:
                 print("\nEstablished connection with database!\n")
 
@@ -193,11 +787,43 @@ class DBhandler:
         if self.db_path is None:
             raise ValueError("Make sure the database location is correct!")
         
-        self.con = sqlite3.connect(self.db_path)
+        self.con = self._connect()
 
         print("\nConnection Opened!\n")
 
 
+    # Create the sqlite connection (pooled handlers may be handed between threads, the pool guards access)
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False, cached_statements=self.statement_cache_size)
+
+        return sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=self.statement_cache_size)
+
+
+    # Track whether sqlite3 can reuse an already prepared statement for this SQL text
+    def _track_statement(self, query_txt: str) -> None:
+        if query_txt in self._statement_lru:
+            self._statement_cache_hits += 1
+            self._statement_lru.move_to_end(query_txt)
+        else:
+            self._statement_cache_misses += 1
+            self._statement_lru[query_txt] = None
+            if len(self._statement_lru) > self.statement_cache_size:
+                self._statement_lru.popitem(last=False)
+
+
+    # Prepared statement cache hit rate, use bound parameters instead of f-strings to keep it high
+    def statement_cache_stats(self) -> dict:
+        lookups = self._statement_cache_hits + self._statement_cache_misses
+
+        return {
+            "hits": self._statement_cache_hits,
+            "misses": self._statement_cache_misses,
+            "cached_statements": len(self._statement_lru),
+            "hit_rate": self._statement_cache_hits / lookups if lookups > 0 else 0.0
+        }
+
+
     # Close connection to db
     def close_connection_db(self) -> None:
         if self.con is None:
@@ -269,9 +895,14 @@ class DBhandler:
 
 
     # Upload data to table
-    def insert_rows(self, table_name: str, data: list[dict]) -> None:
+    def insert_rows(self, table_name: str, data: list[dict], commit: bool=True) -> None:
         if self.con is None:
             raise ValueError("No active database connection. Open the connection first.")
+
+        # DataFrames skip the dict-per-row conversion
+        if isinstance(data, pd.DataFrame):
+            self.insert_dataframe(table_name, data, loader_pragmas=False, commit=commit)
+            return None
         
         if not data:
             raise ValueError("No data provided to insert.")
@@ -287,11 +918,118 @@ class DBhandler:
         # Execute insert for all rows
         cursor = self.con.cursor()
         cursor.executemany(sql, data)
-        self.con.commit()
+        if commit:
+            self.con.commit()
+
+        if self.verbose==1:
+            print(f"\nInserted {len(data)} rows into '{table_name}' successfully.\n")
+
+
+    # Bulk upload a DataFrame / Arrow table as positional tuples, in batches
+    def insert_dataframe(self, table_name: str, data, batch_size: int=100_000, loader_pragmas: bool=True, defer_indexes: bool=False, commit: bool=True, on_conflict: str="IGNORE") -> int:
+        if self.con is None:
+            raise ValueError("No active database connection. Open the connection first.")
+
+        if data is None or len(data) == 0:
+            raise ValueError("No data provided to insert.")
+
+        is_dataframe = isinstance(data, pd.DataFrame)
+        columns = list(data.columns) if is_dataframe else list(data.column_names)
+
+        column_str = ", ".join(columns)
+        placeholder_str = ", ".join(["?"] * len(columns))
+        # on_conflict="REPLACE" upserts rows whose key already exists instead of skipping them
+        sql = f"INSERT OR {on_conflict} INTO {table_name} ({column_str}) VALUES ({placeholder_str})"
+
+        # Pragmas can't change inside a transaction
+        if loader_pragmas:
+            self.con.commit()
+
+        old_pragmas = {}
+        if loader_pragmas:
+            old_pragmas = self._apply_loader_pragmas()
+
+        deferred_indexes = []
+        cursor = self.con.cursor()
+        try:
+            if defer_indexes:
+                deferred_indexes = self.con.execute(
+                    "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+                    (table_name,)
+                ).fetchall()
+                for index_name, _ in deferred_indexes:
+                    self.con.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+            if is_dataframe:
+                for start in range(0, len(data), batch_size):
+                    batch = data.iloc[start:start + batch_size]
+                    cursor.executemany(sql, zip(*[batch[col].tolist() for col in columns]))
+                    if commit:
+                        self.con.commit()
+            else:
+                for batch in data.to_batches(max_chunksize=batch_size):
+                    cursor.executemany(sql, zip(*[col.to_pylist() for col in batch.columns]))
+                    if commit:
+                        self.con.commit()
+
+        except Exception:
+            # Nothing of the failing batch may stay behind (with commit=True earlier batches are already committed)
+            self.con.rollback()
+            raise
+
+        finally:
+            # Dropped indexes come back whether the load worked or not (a rollback may already have restored them)
+            existing_indexes = {row[0] for row in self.con.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=?", (table_name,))}
+            for index_name, index_sql in deferred_indexes:
+                if index_name not in existing_indexes:
+                    self.con.execute(index_sql)
+            if commit or deferred_indexes:
+                self.con.commit()
+
+            if old_pragmas:
+                self.con.commit()
+                self._restore_pragmas(old_pragmas)
 
         if self.verbose==1:
             print(f"\nInserted {len(data)} rows into '{table_name}' successfully.\n")
 
+        return len(data)
+
+
+    # Fast, less durable settings for bulk loads. Returns the old values so they can be restored
+    def _apply_loader_pragmas(self, cache_size_kib: int=262_144) -> dict:
+        old_pragmas = {
+            "synchronous": self.con.execute("PRAGMA synchronous;").fetchone()[0],
+            "journal_mode": self.con.execute("PRAGMA journal_mode;").fetchone()[0],
+            "cache_size": self.con.execute("PRAGMA cache_size;").fetchone()[0]
+        }
+
+        self.con.execute("PRAGMA synchronous=OFF;")
+        self.con.execute(f"PRAGMA cache_size=-{cache_size_kib};")
+
+        # Leave WAL databases in WAL, concurrent readers rely on it
+        if old_pragmas["journal_mode"].lower() != "wal":
+            self.con.execute("PRAGMA journal_mode=MEMORY;")
+
+        return old_pragmas
+
+
+    def _restore_pragmas(self, old_pragmas: dict) -> None:
+        for pragma, value in old_pragmas.items():
+            self.con.execute(f"PRAGMA {pragma}={value};")
+
+
+    # Switch to WAL journaling, so readers don't block on the writer (setting persists in the db file)
+    def enable_wal_mode(self, synchronous: str="NORMAL") -> None:
+        if self.con is None:
+            raise ValueError("No active database connection. Open the connection first.")
+
+        journal_mode = self.con.execute("PRAGMA journal_mode=WAL;").fetchone()[0]
+        self.con.execute(f"PRAGMA synchronous={synchronous};")
+
+        if self.verbose==1:
+            print(f"\nJournal mode set to '{journal_mode}'.\n")
+
 
     # Remove duplicate rows
     def remove_duplicate_rows(self) -> None:
@@ -299,33 +1037,644 @@ class DBhandler:
 
 
     # Query something
-    def query(self, query_txt: str, analyze_query_time: bool= False) -> pd.DataFrame:
+    def query(self, query_txt: str, analyze_query_time: bool= False, params=None) -> pd.DataFrame:
         
         if self.con is None:
             raise ValueError("No active database connection. Open the connection first.")
         
-        if analyze_query_time:
-            t0 = time.time()
+        self._track_statement(query_txt)
+        t0 = time.perf_counter()
+
+        temp_df = pd.read_sql(query_txt, self.con, params=params)
 
-        temp_df = pd.read_sql(query_txt, self.con)
+        elapsed = time.perf_counter() - t0
 
         if analyze_query_time:
-            print(f"\nTime it took to run the query: {(time.time()-t0):2f}")
+            print(f"\nTime it took to run the query: {elapsed:2f}")
+
+        if self.profiler is not None:
+            self.profiler.record(self.con, query_txt, elapsed, len(temp_df), temp_df.memory_usage(deep=True).sum(), params)
 
         return temp_df
     
 
+    # Query something in fixed-size chunks, so memory is bounded by chunk_size instead of the result size
+    def query_iter(self, query_txt: str, chunk_size: int= 100_000, columns: list[str] | None= None, as_arrow: bool= False, params=None):
+
+        if self.con is None:
+            raise ValueError("No active database connection. Open the connection first.")
+
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive.")
+
+        # Column projection, sqlite flattens the subquery so only these columns are read
+        if columns:
+            query_txt = f"SELECT {', '.join(columns)} FROM ({query_txt.strip().rstrip(';')})"
+
+        if as_arrow:
+            import pyarrow as pa
+
+        t0 = time.perf_counter()
+        n_rows, n_bytes = 0, 0
+
+        self._track_statement(query_txt)
+
+        cursor = self.con.cursor()
+        cursor.arraysize = chunk_size
+        cursor.execute(query_txt, params or ())
+        column_names = [description[0] for description in cursor.description]
+
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+
+                if as_arrow:
+                    chunk = pa.RecordBatch.from_arrays(
+                        [pa.array(values) for values in zip(*rows)],
+                        names=column_names
+                    )
+                    chunk_bytes = chunk.nbytes
+                else:
+                    chunk = pd.DataFrame.from_records(rows, columns=column_names)
+                    chunk_bytes = chunk.memory_usage(deep=True).sum() if self.profiler is not None else 0
+
+                n_rows += len(rows)
+                n_bytes += chunk_bytes
+                yield chunk
+        finally:
+            cursor.close()
+
+            # Wall time includes the time the consumer spent between chunks
+            if self.profiler is not None:
+                self.profiler.record(self.con, query_txt, time.perf_counter() - t0, n_rows, n_bytes, params)
+
+
     # Make updates
-    def update(self, query_txt: str) -> None:
+    def update(self, query_txt: str, params=None) -> None:
         if self.con is None:
             raise ValueError("No active database connection. Open the connection first.")
         
+        self._track_statement(query_txt)
+        t0 = time.perf_counter()
+
         cursor = self.con.cursor()
 
-        cursor.execute(query_txt)
+        cursor.execute(query_txt, params or ())
         self.con.commit()
 
+        if self.profiler is not None:
+            self.profiler.record(self.con, query_txt, time.perf_counter() - t0, cursor.rowcount, params=params)
+
         if self.verbose==1:
             print('\nDatabase updated!\n')
 
         return None
+
+
+def run_single_writer(write_queue, table_name: str, db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', rows_per_commit: int=500_000, stats_queue=None, on_conflict: str="IGNORE") -> dict:
+    """
+    Dedicated writer loop (meant to run in its own process).
+    Takes DataFrames (or Arrow tables) off write_queue and inserts them over one WAL connection,
+    committing once every rows_per_commit rows. A None on the queue stops the writer.
+    Batches may come as (source, frame) tuples, then inserted row counts are kept per source.
+    on_conflict is passed on to insert_dataframe ("IGNORE" keeps existing rows, "REPLACE" upserts).
+    """
+
+    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
+    db_handler.enable_wal_mode()
+
+    rows_written = 0
+    rows_since_commit = 0
+    batches = 0
+    rows_inserted_per_source = {}
+    t0 = time.time()
+
+    while True:
+        batch = write_queue.get()
+        if batch is None:
+            break
+
+        source = None
+        if isinstance(batch, tuple):
+            source, batch = batch
+
+        if len(batch) == 0:
+            continue
+
+        changes_before = db_handler.con.total_changes
+        db_handler.insert_dataframe(table_name, batch, loader_pragmas=False, commit=False, on_conflict=on_conflict)
+
+        if source is not None:
+            rows_inserted_per_source[source] = rows_inserted_per_source.get(source, 0) + db_handler.con.total_changes - changes_before
+
+        rows_written += len(batch)
+        rows_since_commit += len(batch)
+        batches += 1
+
+        if rows_since_commit >= rows_per_commit:
+            db_handler.con.commit()
+            rows_since_commit = 0
+
+    db_handler.con.commit()
+    db_handler.close_connection_db()
+
+    elapsed = time.time() - t0
+    stats = {
+        "rows": rows_written,
+        "batches": batches,
+        "seconds": elapsed,
+        "rows_per_second": rows_written / elapsed if elapsed > 0 else 0.0,
+        "rows_inserted_per_source": rows_inserted_per_source
+    }
+
+    print(f"\nWriter inserted {rows_written} rows into '{table_name}' in {elapsed:.2f}s ({stats['rows_per_second']:.0f} rows/s)\n")
+
+    if stats_queue is not None:
+        stats_queue.put(stats)
+
+    return stats
+
+
+# Split a table into month ranges holding roughly equal numbers of rows (month ranges keep the output month-ordered)
+def split_month_ranges(db_handler: DBhandler, table_name: str, n_ranges: int) -> list[tuple[str, str]]:
+    if n_ranges < 1:
+        raise ValueError("n_ranges must be at least 1.")
+
+    db_handler.update(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_month ON {table_name}(month)")
+    month_counts = db_handler.query(f"SELECT month, COUNT(*) AS n FROM {table_name} GROUP BY month ORDER BY month")
+    if month_counts.empty:
+        return []
+
+    target_rows = month_counts["n"].sum() / n_ranges
+
+    month_ranges = []
+    first_month, rows_in_range = None, 0
+    for month, n in zip(month_counts["month"], month_counts["n"]):
+        if first_month is None:
+            first_month = month
+        rows_in_range += n
+
+        if rows_in_range >= target_rows:
+            month_ranges.append((first_month, month))
+            first_month, rows_in_range = None, 0
+
+    if first_month is not None:
+        month_ranges.append((first_month, month_counts["month"].iloc[-1]))
+
+    return month_ranges
+
+
+# Version counter per derived table, so in-memory caches can tell when to reload
+def bump_table_version(db_handler: DBhandler, table_name: str) -> int:
+    db_handler.create_table("table_versions", columns={
+        "table_name": "TEXT PRIMARY KEY",
+        "version": "INTEGER",
+        "updated_at": "TEXT"
+    })
+    db_handler.update(
+        """
+        INSERT INTO table_versions (table_name, version, updated_at)
+        VALUES (?, 1, datetime('now'))
+        ON CONFLICT(table_name) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at
+        """,
+        params=(table_name,)
+    )
+
+    return get_table_version(db_handler, table_name)
+
+
+def get_table_version(db_handler: DBhandler, table_name: str) -> int:
+    try:
+        row = db_handler.con.execute("SELECT version FROM table_versions WHERE table_name = ?", (table_name,)).fetchone()
+    except sqlite3.OperationalError:
+        # table_versions doesn't exist yet
+        return 0
+
+    return row[0] if row else 0
+
+
+def create_ward_month_index(db_handler: DBhandler) -> None:
+    # Covering index for per-ward monthly aggregates: a GROUP BY month for one ward never touches the table rows.
+    # idx_crime_ward_code is a prefix of it, so it goes
+    db_handler.update("CREATE INDEX IF NOT EXISTS idx_crime_ward_month ON crime(ward_code, month, average_imd_decile, stringency_index)")
+    db_handler.update("DROP INDEX IF EXISTS idx_crime_ward_code")
+
+
+def refresh_ward_month_stats(db_handler: DBhandler) -> int:
+    """
+    Rebuilds ward_month_stats (crime count, mean IMD decile & stringency per ward and month) from crime.
+    The enrichment stage rebuilds crime from scratch, so any month can have changed (a backfilled or reloaded
+    CSV, new ward boundaries) and wards or months can have disappeared: the table is replaced as a whole.
+    It's one GROUP BY over the covering (ward_code, month) index, delete & insert share a transaction.
+    """
+
+    db_handler.create_table("ward_month_stats", columns={
+        "ward_code": "TEXT",
+        "month": "TEXT",
+        "num_of_crimes": "INTEGER",
+        "avg_imd": "REAL",
+        "covid_index": "REAL",
+        "PRIMARY KEY": "(ward_code, month)"
+    })
+
+    try:
+        db_handler.con.execute("DELETE FROM ward_month_stats")
+        db_handler.con.execute(
+            """
+            INSERT INTO ward_month_stats (ward_code, month, num_of_crimes, avg_imd, covid_index)
+            SELECT
+                ward_code,
+                month,
+                COUNT(crime_id),
+                AVG(average_imd_decile),
+                AVG(stringency_index)
+            FROM
+                crime
+            WHERE
+                ward_code IS NOT NULL
+            GROUP BY
+                ward_code, month
+            """
+        )
+        db_handler.con.commit()
+    except Exception:
+        db_handler.con.rollback()
+        raise
+
+    version = bump_table_version(db_handler, "ward_month_stats")
+
+    if db_handler.verbose==1:
+        print(f"\nward_month_stats rebuilt (version {version}).\n")
+
+    return version
+
+
+class DBpool:
+    """
+    Process-wide pool of DBhandlers for one database file.
+    Hands out read-only handlers for query paths and a single shared writer handler,
+    so model functions reuse warm connections instead of reconnecting per call.
+    """
+
+    def __init__(self, db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', max_readers: int=4, verbose: int=0, profiler: QueryProfiler | None=None) -> None:
+
+        if max_readers < 1:
+            raise ValueError("Pool needs at least one reader connection.")
+
+        self.db_loc = db_loc
+        self.db_name = db_name
+        self.max_readers = max_readers
+        self.verbose = verbose
+        self.profiler = profiler
+
+        self._idle_readers = []
+        self._open_readers = 0
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self.closed = False
+
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "writer_hits": 0, "writer_waits": 0}
+
+
+    # Borrow a read-only handler, reusing an idle one if possible
+    def acquire_reader(self) -> DBhandler:
+        with self._cond:
+            if not self._idle_readers and self._open_readers >= self.max_readers and not self.closed:
+                self._stats["waits"] += 1
+                # Wake up for an idle reader or for a slot freed by a closed one
+                while not self._idle_readers and self._open_readers >= self.max_readers and not self.closed:
+                    self._cond.wait()
+
+            if self.closed:
+                raise RuntimeError(f"Pool for {self.db_name} is closed.")
+
+            if self._idle_readers:
+                self._stats["hits"] += 1
+                db_handler = self._idle_readers.pop()
+                db_handler.profiler = self.profiler
+                return db_handler
+
+            # Reserve the slot before connecting, so other threads see it as taken
+            self._stats["misses"] += 1
+            self._open_readers += 1
+
+        try:
+            return DBhandler(db_loc=self.db_loc, db_name=self.db_name, verbose=self.verbose, read_only=True, profiler=self.profiler)
+        except:
+            with self._cond:
+                self._open_readers -= 1
+                self._cond.notify()
+            raise
+
+
+    # Give a reader back to the pool
+    def release_reader(self, db_handler: DBhandler) -> None:
+        with self._cond:
+            if db_handler.con is None:
+                # Caller closed it, forget about this slot
+                self._open_readers -= 1
+            elif self.closed:
+                # Borrowed while the pool was closed, close it instead of keeping it idle
+                db_handler.close_connection_db()
+                self._open_readers -= 1
+            else:
+                self._idle_readers.append(db_handler)
+            self._cond.notify()
+
+
+    @contextmanager
+    def reader(self):
+        db_handler = self.acquire_reader()
+        try:
+            yield db_handler
+        finally:
+            self.release_reader(db_handler)
+
+
+    # Exclusive access to the one writer handler
+    @contextmanager
+    def writer(self):
+        if not self._writer_lock.acquire(blocking=False):
+            with self._cond:
+                self._stats["writer_waits"] += 1
+            self._writer_lock.acquire()
+
+        try:
+            if self.closed:
+                raise RuntimeError(f"Pool for {self.db_name} is closed.")
+
+            if self._writer is None or self._writer.con is None:
+                self._writer = DBhandler(db_loc=self.db_loc, db_name=self.db_name, verbose=self.verbose)
+            else:
+                with self._cond:
+                    self._stats["writer_hits"] += 1
+
+            self._writer.profiler = self.profiler
+
+            yield self._writer
+        finally:
+            self._writer_lock.release()
+
+
+    # Pool statistics, useful for sizing max_readers
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["open_readers"] = self._open_readers
+            stats["idle_readers"] = len(self._idle_readers)
+            stats["writer_open"] = self._writer is not None and self._writer.con is not None
+            stats["open_connections"] = self._open_readers + int(stats["writer_open"])
+
+            # Statement cache over the handlers currently in the pool
+            handlers = list(self._idle_readers) + ([self._writer] if stats["writer_open"] else [])
+            cache_hits = sum(db_handler.statement_cache_stats()["hits"] for db_handler in handlers)
+            cache_misses = sum(db_handler.statement_cache_stats()["misses"] for db_handler in handlers)
+            stats["statement_cache_hit_rate"] = cache_hits / (cache_hits + cache_misses) if cache_hits + cache_misses > 0 else 0.0
+
+        return stats
+
+
+    # Close every idle connection & mark the pool closed (borrowed readers are closed when released)
+    def close_all(self) -> None:
+        with self._cond:
+            self.closed = True
+            for db_handler in self._idle_readers:
+                db_handler.close_connection_db()
+            self._open_readers -= len(self._idle_readers)
+            self._idle_readers = []
+            self._cond.notify_all()
+
+        with self._writer_lock:
+            if self._writer is not None and self._writer.con is not None:
+                self._writer.close_connection_db()
+            self._writer = None
+
+
+# Registry of pools, one per database file in this process
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+
+def get_db_pool(db_loc: str= '../data/', db_name: str= 'crime_data_UK_v4.db', max_readers: int=4) -> DBpool:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    db_path = os.path.abspath(os.path.join(base_dir, db_loc, db_name))
+
+    with _db_pools_lock:
+        if db_path not in _db_pools:
+            _db_pools[db_path] = DBpool(db_loc=db_loc, db_name=db_name, max_readers=max_readers)
+
+        return _db_pools[db_path]
+
+
+def close_all_db_pools() -> None:
+    with _db_pools_lock:
+        for pool in _db_pools.values():
+            pool.close_all()
+        _db_pools.clear()
+
+
+class PipelineStage:
+    """
+    One step of the DB build. input_paths are files/directories and input_tables are tables the stage reads,
+    output_tables are the tables it (re)builds. run(db_handler, runner) does the work and may return a dict of details.
+    """
+
+    def __init__(self, name: str, run, input_paths: list[str]=[], input_tables: list[str]=[], output_tables: list[str]=[]) -> None:
+        self.name = name
+        self.run = run
+        self.input_paths = list(input_paths)
+        self.input_tables = list(input_tables)
+        self.output_tables = list(output_tables)
+
+
+class PipelineRunner:
+    """
+    Runs PipelineStages in order with a checkpoint per stage (pipeline_checkpoints) and per chunk (pipeline_chunks).
+    A stage is skipped when it finished before with the same input signature (input file sizes/mtimes & input table
+    versions) and its output tables still exist. Finishing a stage bumps the version of its output tables, so every
+    stage downstream of a change reruns. A failed stage stops the run; the next run resumes from it.
+    """
+
+    def __init__(self, db_handler: DBhandler, stages: list[PipelineStage], artifact_dir: str | None=None) -> None:
+        self.db_handler = db_handler
+        self.stages = stages
+        self.artifact_dir = artifact_dir or os.path.join(db_handler.db_loc, f"{db_handler.db_name}.artifacts")
+        self.timings = []
+
+        os.makedirs(self.artifact_dir, exist_ok=True)
+
+        db_handler.create_table("pipeline_checkpoints", columns={
+            "stage": "TEXT PRIMARY KEY",
+            "signature": "TEXT",
+            "status": "TEXT",
+            "started_at": "TEXT",
+            "finished_at": "TEXT",
+            "seconds": "REAL",
+            "error": "TEXT",
+            "details": "TEXT"
+        })
+        db_handler.create_table("pipeline_chunks", columns={
+            "stage": "TEXT",
+            "chunk": "TEXT",
+            "status": "TEXT",
+            "attempts": "INTEGER",
+            "seconds": "REAL",
+            "error": "TEXT",
+            "updated_at": "TEXT",
+            "PRIMARY KEY": "(stage, chunk)"
+        })
+
+
+    # Path for an intermediate file of a stage (kept between runs)
+    def artifact_path(self, stage_name: str, file_name: str) -> str:
+        return os.path.join(self.artifact_dir, f"{stage_name}.{file_name}")
+
+
+    # Hash over input file sizes/mtimes & input table versions
+    def signature(self, stage: PipelineStage) -> str:
+        files = []
+        for path in stage.input_paths:
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path):
+                    for file in sorted(filenames):
+                        file_path = os.path.join(dirpath, file)
+                        file_stat = os.stat(file_path)
+                        files.append([file_path, file_stat.st_size, file_stat.st_mtime])
+            elif os.path.exists(path):
+                file_stat = os.stat(path)
+                files.append([path, file_stat.st_size, file_stat.st_mtime])
+            else:
+                files.append([path, None, None])
+
+        tables = [[table_name, get_table_version(self.db_handler, table_name)] for table_name in stage.input_tables]
+
+        return hashlib.sha256(json.dumps({"files": sorted(files), "tables": tables}).encode()).hexdigest()
+
+
+    def checkpoint(self, stage_name: str) -> dict | None:
+        row = self.db_handler.con.execute("SELECT signature, status, error FROM pipeline_checkpoints WHERE stage = ?", (stage_name,)).fetchone()
+        if row is None:
+            return None
+
+        return {"signature": row[0], "status": row[1], "error": row[2]}
+
+
+    def is_up_to_date(self, stage: PipelineStage, signature: str) -> bool:
+        checkpoint = self.checkpoint(stage.name)
+        if checkpoint is None or checkpoint["status"] != "done" or checkpoint["signature"] != signature:
+            return False
+
+        existing_tables = {row[0] for row in self.db_handler.con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+        return all(table_name in existing_tables for table_name in stage.output_tables)
+
+
+    # Chunks of a stage in their planned order; plans them on the first call of a (re)started stage
+    def plan_chunks(self, stage_name: str, chunks: list[str]) -> list[tuple[str, str]]:
+        planned = self.db_handler.con.execute("SELECT chunk, status FROM pipeline_chunks WHERE stage = ? ORDER BY rowid", (stage_name,)).fetchall()
+        if planned:
+            return planned
+
+        self.db_handler.con.executemany(
+            "INSERT INTO pipeline_chunks (stage, chunk, status, attempts, updated_at) VALUES (?, ?, 'pending', 0, datetime('now'))",
+            [(stage_name, chunk) for chunk in chunks]
+        )
+        self.db_handler.con.commit()
+
+        return [(chunk, "pending") for chunk in chunks]
+
+
+    # commit=False lets a stage commit the chunk's status together with the chunk's rows
+    def record_chunk(self, stage_name: str, chunk: str, status: str, attempts: int, seconds: float, error: str | None=None, commit: bool=True) -> None:
+        self.db_handler.con.execute(
+            """
+            UPDATE pipeline_chunks
+            SET status = ?, attempts = ?, seconds = ?, error = ?, updated_at = datetime('now')
+            WHERE stage = ? AND chunk = ?
+            """,
+            (status, attempts, seconds, error, stage_name, chunk)
+        )
+        if commit:
+            self.db_handler.con.commit()
+
+
+    def chunk_report(self, stage_name: str) -> pd.DataFrame:
+        return self.db_handler.query("SELECT chunk, status, attempts, seconds, error FROM pipeline_chunks WHERE stage = ? ORDER BY rowid", params=(stage_name,))
+
+
+    def _start_stage(self, stage: PipelineStage, signature: str) -> None:
+        checkpoint = self.checkpoint(stage.name)
+
+        # Only an interrupted run on unchanged inputs keeps its chunk progress
+        if checkpoint is None or checkpoint["status"] == "done" or checkpoint["signature"] != signature:
+            self.db_handler.update("DELETE FROM pipeline_chunks WHERE stage = ?", params=(stage.name,))
+
+        self.db_handler.update(
+            """
+            INSERT INTO pipeline_checkpoints (stage, signature, status, started_at)
+            VALUES (?, ?, 'running', datetime('now'))
+            ON CONFLICT(stage) DO UPDATE SET
+                signature = excluded.signature,
+                status = 'running',
+                started_at = excluded.started_at,
+                finished_at = NULL,
+                seconds = NULL,
+                error = NULL
+            """,
+            params=(stage.name, signature)
+        )
+
+
+    def _finish_stage(self, stage: PipelineStage, status: str, seconds: float, error: str | None=None, details: dict | None=None) -> None:
+        self.db_handler.update(
+            """
+            UPDATE pipeline_checkpoints
+            SET status = ?, finished_at = datetime('now'), seconds = ?, error = ?, details = ?
+            WHERE stage = ?
+            """,
+            params=(status, seconds, error, json.dumps(details or {}, default=str), stage.name)
+        )
+
+
+    def run(self, force: list[str]=[]) -> pd.DataFrame:
+        """
+        Runs every stage that isn't up to date (or is listed in force) and returns the per-stage timings.
+        """
+
+        self.timings = []
+        for stage in self.stages:
+            signature = self.signature(stage)
+
+            if stage.name not in force and self.is_up_to_date(stage, signature):
+                self.timings.append({"stage": stage.name, "status": "skipped", "seconds": 0.0})
+                print(f"\nStage '{stage.name}' is up to date, skipping.\n")
+                continue
+
+            print(f"\nRunning stage '{stage.name}' ...\n")
+            self._start_stage(stage, signature)
+
+            t0 = time.time()
+            try:
+                details = stage.run(self.db_handler, self)
+            except Exception as e:
+                # Roll back the stage's uncommitted writes, checkpoints & committed chunks stay
+                self.db_handler.con.rollback()
+                seconds = time.time() - t0
+                self._finish_stage(stage, "failed", seconds, error=f"{type(e).__name__}: {e}")
+                self.timings.append({"stage": stage.name, "status": "failed", "seconds": seconds})
+                print(f"\nStage '{stage.name}' failed after {seconds:.1f}s: {e}\n")
+                raise
+
+            for table_name in stage.output_tables:
+                bump_table_version(self.db_handler, table_name)
+
+            seconds = time.time() - t0
+            self._finish_stage(stage, "done", seconds, details=details)
+            self.timings.append({"stage": stage.name, "status": "done", "seconds": seconds})
+            print(f"\nStage '{stage.name}' done in {seconds:.1f}s.\n")
+
+        return pd.DataFrame(self.timings, columns=["stage", "status", "seconds"])
@@ -1,74 +1,77 @@
-from DB_utils import DBhandler
+from DB_utils import get_db_pool
+from ML_utils import get_ward_slice
 import plotly.graph_objects as go
-from shapely import wkt
-import geopandas as gpd
+import shapely
 import numpy as np
 from sklearn.metrics import pairwise_distances_argmin
 import pandas as pd
 from geopy.distance import geodesic
+from functools import lru_cache
 
 
-def run_kmeans_weighted(ward_code: str, n_crimes: int, imd_value: float, n_clusters: int = 100, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db"):
-    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
-
-    # Query lat/long from temp crime table
-    crime_query = f"""
-    SELECT 
-        lat AS latitude, 
-        long AS longitude
-    FROM 
-        temp_crime_{ward_code}
-    WHERE 
-        lat IS NOT NULL 
-        AND long IS NOT NULL
-    ORDER BY 
-        RANDOM()
-    LIMIT 
-        {int(n_crimes)};
+# Weighted K-means with vectorized centroid updates (seeded, so the same input gives the same clusters)
+def weighted_kmeans(coords: np.ndarray, weights: np.ndarray, n_clusters: int, max_iter: int=100, tol: float=1e-4, seed: int=42) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (n_clusters, 2) centroids & the cluster label of every point.
+    Per-cluster weighted sums come from np.bincount, empty clusters are reinitialized on a random point.
+    Same init, RNG draws & assignment as the old per-cluster np.average loop, but np.average sums the weights
+    pairwise, so centroids only match it to the last bit. On distinct coordinates the labels are identical;
+    on duplicated (snapped) coordinates an exact distance tie can put a point in another cluster, and the run
+    then converges to a different local optimum of similar inertia (see benchmarks.benchmark_kmeans).
     """
-    crime_locations = db_handler.query(crime_query)
-    db_handler.close_connection_db()
-
-    if crime_locations.empty:
-        raise ValueError(f"No valid lat/long entries found for ward {ward_code}")
-
-    coords = crime_locations[["latitude", "longitude"]].to_numpy()
-
-    # Weighted K-means Core Logic
-    # Invert IMD so that lower deprivation score → higher weight
-    ward_weight = 10 - imd_value
-    weights = np.full(coords.shape[0], ward_weight)
-
 
     # Initialize centroids randomly
-    rng = np.random.default_rng(42)
+    rng = np.random.default_rng(seed)
     initial_idxs = rng.choice(coords.shape[0], n_clusters, replace=False)
     centroids = coords[initial_idxs]
 
-    max_iter = 100
-    tol = 1e-4
+    weighted_coords = coords * weights[:, None]
 
     for _ in range(max_iter):
         # Step 1: Assign points to nearest centroid
         labels = pairwise_distances_argmin(coords, centroids)
 
         # Step 2: Update centroids with weights
-        new_centroids = np.zeros_like(centroids)
-        for i in range(n_clusters):
-            mask = labels == i
-            if not np.any(mask):
-                # Reinitialize empty clusters
-                new_centroids[i] = coords[rng.choice(coords.shape[0])]
-                continue
-            cluster_points = coords[mask]
-            cluster_weights = weights[mask]
-            new_centroids[i] = np.average(cluster_points, axis=0, weights=cluster_weights)
+        counts = np.bincount(labels, minlength=n_clusters)
+        weight_sums = np.bincount(labels, weights=weights, minlength=n_clusters)
+        coord_sums = np.column_stack([
+            np.bincount(labels, weights=weighted_coords[:, dim], minlength=n_clusters)
+            for dim in range(coords.shape[1])
+        ])
+
+        empty = counts == 0
+        new_centroids = np.empty_like(centroids)
+        new_centroids[~empty] = coord_sums[~empty] / weight_sums[~empty, None]
+        # Reinitialize empty clusters
+        new_centroids[empty] = coords[rng.choice(coords.shape[0], size=int(empty.sum()))]
 
         # Step 3: Check convergence
         if np.linalg.norm(new_centroids - centroids) < tol:
             break
         centroids = new_centroids
 
+    return centroids, labels
+
+
+def run_kmeans_weighted(ward_code: str, n_crimes: int, imd_value: float, n_clusters: int = 100, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db"):
+    # Random sample of the ward's crime locations, from the in-memory ward slice cache
+    coords = get_ward_slice(ward_code, db_loc=db_loc, db_name=db_name).coordinates()
+    sample_idxs = np.random.default_rng().permutation(coords.shape[0])[:max(int(n_crimes), 0)]
+    crime_locations = pd.DataFrame(coords[sample_idxs], columns=["latitude", "longitude"])
+
+    if crime_locations.empty:
+        raise ValueError(f"No valid lat/long entries found for ward {ward_code}")
+
+    coords = crime_locations[["latitude", "longitude"]].to_numpy()
+
+    # Weighted K-means Core Logic
+    # Invert IMD so that lower deprivation score → higher weight
+    ward_weight = 10 - imd_value
+    weights = np.full(coords.shape[0], ward_weight)
+
+
+    centroids, labels = weighted_kmeans(coords, weights, n_clusters)
+
     crime_locations["cluster"] = labels
     return centroids, crime_locations
 
@@ -118,25 +121,8 @@ def plot_kmeans_clusters(clustered_data, centroids, ward_code, db_loc: str="../d
         hovertext=centroid_hover_texts
     ))
     
-    # Connect to the database
-    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
-
-    # Query WKT geometry from the ward geometry table (adjust table name if needed)
-    query = f"""
-    SELECT ward_code, geometry
-    FROM ward_location
-    WHERE ward_code = '{ward_code}'
-    """
-
-    ward_geom_df = db_handler.query(query)
-    db_handler.close_connection_db()
-
-    # Convert WKT to Shapely geometry
-    geom = wkt.loads(ward_geom_df["geometry"].iloc[0])
-
-    # Wrap in GeoSeries and reproject
-    ward_geom = gpd.GeoSeries([geom], crs="EPSG:27700").to_crs("EPSG:4326")
-    geom = ward_geom.iloc[0]  # Get reprojected geometry
+    # Ward boundary, already in EPSG:4326
+    geom = load_ward_boundary(ward_code, db_loc=db_loc, db_name=db_name)
 
     # Extract coordinates
     boundary_coords = list(geom.exterior.coords)
@@ -167,6 +153,26 @@ def plot_kmeans_clusters(clustered_data, centroids, ward_code, db_loc: str="../d
     return fig
 
 
+# Ward boundaries don't change between requests, so keep them in memory
+@lru_cache(maxsize=1024)
+def load_ward_boundary(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db"):
+
+    # Query pre-projected WKB geometry from the ward geometry table
+    query = """
+    SELECT ward_code, geometry_wkb
+    FROM ward_location
+    WHERE ward_code = ?
+    """
+
+    with get_db_pool(db_loc=db_loc, db_name=db_name).reader() as db_handler:
+        ward_geom_df = db_handler.query(query, params=(ward_code,))
+
+    if ward_geom_df.empty:
+        raise ValueError(f"No geometry found for ward {ward_code}")
+
+    return shapely.from_wkb(ward_geom_df["geometry_wkb"].iloc[0])
+
+
 def calc_avg_distance_between_crime_and_officer(clustered_data, centroids):
 
     df = pd.merge(
@@ -1,26 +1,277 @@
-from DB_utils import DBhandler
+from DB_utils import get_db_pool, get_table_version
 
+import numpy as np
+import pandas as pd
+import threading
+from collections import OrderedDict
 
-def create_temp_table(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db")-> None:
 
-    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
+class WardSlice:
+    """
+    The crimes of one ward as compact column arrays (float64 coordinates, month as datetime64[M],
+    crime type as categorical codes, float32 IMD decile & stringency).
+    """
 
-    # Create a temporary table for the selected ward
-    create_temp_table_query = f"""
-            CREATE TABLE IF NOT EXISTS temp_crime_{ward_code} AS
-            SELECT * FROM crime
-            WHERE ward_code = '{ward_code}';
+    def __init__(self, crime_df: pd.DataFrame, ward_code: str, version: int=0) -> None:
+        self.ward_code = ward_code
+        self.version = version
+
+        self.lat = crime_df["lat"].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.long = crime_df["long"].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.month = pd.to_datetime(crime_df["month"], format="%Y-%m").to_numpy().astype("datetime64[M]")
+
+        crime_type = pd.Categorical(crime_df["crime_type"])
+        self.crime_type_codes = crime_type.codes
+        self.crime_types = np.asarray(crime_type.categories)
+
+        self.average_imd_decile = crime_df["average_imd_decile"].to_numpy(dtype=np.float32, na_value=np.nan)
+        self.stringency_index = crime_df["stringency_index"].to_numpy(dtype=np.float32, na_value=np.nan)
+
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in [self.lat, self.long, self.month, self.crime_type_codes, self.average_imd_decile, self.stringency_index]) + sum(len(str(t)) for t in self.crime_types)
+
+
+    @classmethod
+    def from_db(cls, db_handler, ward_code: str) -> "WardSlice":
+        version = get_table_version(db_handler, "crime")
+        crime_df = db_handler.query(
+            """
+            SELECT lat, long, month, crime_type, average_imd_decile, stringency_index
+            FROM crime
+            WHERE ward_code = ?
+            """,
+            params=(ward_code,)
+        )
+
+        return cls(crime_df, ward_code, version)
+
+
+    # Coordinates of crimes with a location, as an (n, 2) array of (lat, long)
+    def coordinates(self) -> np.ndarray:
+        has_location = ~(np.isnan(self.lat) | np.isnan(self.long))
+        return np.column_stack([self.lat[has_location], self.long[has_location]])
+
+
+class WardSliceCache:
+    """
+    In-process LRU cache of WardSlices keyed on (database, ward, crime table version), evicting the least
+    recently used slices once the cached arrays exceed max_bytes. Replaces the temp_crime_<ward> tables:
+    nothing is written to disk and concurrent requests for one ward share a single load.
+    """
+
+    def __init__(self, max_bytes: int=256 * 1024**2) -> None:
+        self.max_bytes = max_bytes
+        self.slices = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+
+    def get(self, ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> WardSlice:
+        with get_db_pool(db_loc=db_loc, db_name=db_name).reader() as db_handler:
+            key = (db_handler.db_path, ward_code, get_table_version(db_handler, "crime"))
+
+            with self._lock:
+                if key in self.slices:
+                    self.slices.move_to_end(key)
+                    self.hits += 1
+                    return self.slices[key]
+
+                load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+            # One load per key, other requests for the same ward wait for it
+            with load_lock:
+                with self._lock:
+                    if key in self.slices:
+                        self.slices.move_to_end(key)
+                        self.hits += 1
+                        return self.slices[key]
+
+                try:
+                    ward_slice = WardSlice.from_db(db_handler, ward_code)
+                except Exception:
+                    with self._lock:
+                        self._load_locks.pop(key, None)
+                    raise
+
+                with self._lock:
+                    self.misses += 1
+                    self._put(key, ward_slice)
+                    self._load_locks.pop(key, None)
+
+        return ward_slice
+
+
+    def _put(self, key: tuple, ward_slice: WardSlice) -> None:
+        # Older versions of the same ward are stale
+        for old_key in [k for k in self.slices if k[:2] == key[:2]]:
+            self.nbytes -= self.slices.pop(old_key).nbytes
+
+        self.slices[key] = ward_slice
+        self.nbytes += ward_slice.nbytes
+
+        while self.nbytes > self.max_bytes and len(self.slices) > 1:
+            _, evicted = self.slices.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "slices": len(self.slices),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0
+            }
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self.slices.clear()
+            self.nbytes = 0
+
+
+_ward_slice_cache = WardSliceCache()
+
+
+def get_ward_slice(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> WardSlice:
+    return _ward_slice_cache.get(ward_code, db_loc=db_loc, db_name=db_name)
+
+
+def ward_slice_cache_stats() -> dict:
+    return _ward_slice_cache.stats()
+
+
+class WardMonthCube:
+    """
+    In-memory (wards x months) arrays built from the ward_month_stats table.
+    Missing ward/month cells hold 0 crimes and NaN for the IMD & stringency means.
+    """
+
+    def __init__(self, stats_df: pd.DataFrame, version: int=0) -> None:
+        self.version = version
+
+        self.ward_codes = np.sort(stats_df["ward_code"].unique())
+        self.ward_index = {ward_code: i for i, ward_code in enumerate(self.ward_codes)}
+
+        month_starts = pd.to_datetime(stats_df["month"])
+        if len(stats_df) > 0:
+            self.months = pd.date_range(month_starts.min(), month_starts.max(), freq="MS")
+        else:
+            self.months = pd.DatetimeIndex([], freq="MS")
+
+        shape = (len(self.ward_codes), len(self.months))
+        self.num_of_crimes = np.zeros(shape, dtype=np.float64)
+        self.avg_imd = np.full(shape, np.nan)
+        self.covid_index = np.full(shape, np.nan)
+
+        if len(stats_df) > 0:
+            rows = stats_df["ward_code"].map(self.ward_index).to_numpy()
+            cols = self.months.get_indexer(month_starts)
+
+            self.num_of_crimes[rows, cols] = stats_df["num_of_crimes"].to_numpy()
+            self.avg_imd[rows, cols] = stats_df["avg_imd"].to_numpy()
+            self.covid_index[rows, cols] = stats_df["covid_index"].to_numpy()
+
+        # First & last month with crimes per ward
+        has_crimes = self.num_of_crimes > 0
+        self.first_month = np.where(has_crimes.any(axis=1), has_crimes.argmax(axis=1), 0)
+        self.last_month = np.where(has_crimes.any(axis=1), shape[1] - 1 - has_crimes[:, ::-1].argmax(axis=1), -1)
+
+
+    @classmethod
+    def from_db(cls, db_handler) -> "WardMonthCube":
+        version = get_table_version(db_handler, "ward_month_stats")
+        stats_df = db_handler.query("SELECT ward_code, month, num_of_crimes, avg_imd, covid_index FROM ward_month_stats")
+
+        return cls(stats_df, version)
+
+
+    # Monthly series of one ward, from its first to its last month with crimes
+    def series(self, ward_code: str) -> pd.DataFrame:
+        if ward_code not in self.ward_index:
+            raise ValueError(f"No aggregated crime data for ward {ward_code}")
+
+        i = self.ward_index[ward_code]
+        window = slice(self.first_month[i], self.last_month[i] + 1)
+
+        return pd.DataFrame({
+            "num_of_crimes": self.num_of_crimes[i, window],
+            "avg_imd": self.avg_imd[i, window],
+            "covid_index": self.covid_index[i, window]
+        }, index=pd.Index(self.months[window], name="month"))
+
+
+# One cube per database file, reloaded when ward_month_stats gets a new version
+_ward_month_cubes = {}
+_ward_month_cubes_lock = threading.Lock()
+
+
+def get_ward_month_cube(db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> WardMonthCube:
+    pool = get_db_pool(db_loc=db_loc, db_name=db_name)
+
+    with pool.reader() as db_handler:
+        version = get_table_version(db_handler, "ward_month_stats")
+        key = db_handler.db_path
+
+        with _ward_month_cubes_lock:
+            cube = _ward_month_cubes.get(key)
+            if cube is None or cube.version != version:
+                cube = WardMonthCube.from_db(db_handler)
+                _ward_month_cubes[key] = cube
+
+    return cube
+
+
+def query_ward_month_series(db_handler, ward_code: str) -> pd.DataFrame:
+    # Monthly aggregates of one ward computed by SQLite (GROUP BY month over the covering idx_crime_ward_month index),
+    # so only one row per month crosses into Python
+    stats_df = db_handler.query(
         """
+        SELECT
+            ward_code,
+            month,
+            COUNT(*) AS num_of_crimes,
+            AVG(average_imd_decile) AS avg_imd,
+            AVG(stringency_index) AS covid_index
+        FROM
+            crime
+        WHERE
+            ward_code = ?
+        GROUP BY
+            month
+        ORDER BY
+            month
+        """,
+        params=(ward_code,)
+    )
 
-    db_handler.update(create_temp_table_query) 
+    if stats_df.empty:
+        raise ValueError(f"No crime data for ward {ward_code}")
 
-    db_handler.close_connection_db()
+    return WardMonthCube(stats_df).series(ward_code)
 
 
-def delete_temp_table(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> None:
-    
-    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
+def get_ward_month_series(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> pd.DataFrame:
+    cube = get_ward_month_cube(db_loc=db_loc, db_name=db_name)
+    if ward_code in cube.ward_index:
+        return cube.series(ward_code)
 
-    drop_query = f"DROP TABLE IF EXISTS temp_crime_{ward_code};"
-    db_handler.update(drop_query)
-    db_handler.close_connection_db()
+    # Not in ward_month_stats (yet), aggregate this ward in SQLite
+    with get_db_pool(db_loc=db_loc, db_name=db_name).reader() as db_handler:
+        return query_ward_month_series(db_handler, ward_code)
@@ -1,41 +1,76 @@
-from DB_utils import DBhandler
+from DB_utils import get_db_pool, get_table_version
+from ML_utils import get_ward_month_cube, get_ward_month_series
 
+import numpy as np
 import pandas as pd
 import statsmodels.api as sm
 from statsmodels.tsa.stattools import adfuller
 import plotly.graph_objects as go
+from multiprocessing import Pool, TimeoutError as PoolTimeoutError
+import psutil
+from tqdm import tqdm
+import json
+import hashlib
+import sqlite3
+import sys
+import time
+import warnings
 
 
-def timeseries(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db"):
-    # Load DBhandler to get data path
-    db_handler = DBhandler(db_loc=db_loc, db_name=db_name, verbose=0)
+def backtest_one_step(df: pd.DataFrame, results, p_d_q: tuple, p_d_q_s: tuple, start: int=10, end: int | None=None, mode: str="filter") -> pd.Series:
+    """
+    One-step-ahead forecasts for the months at positions start+1 .. end of df (end defaults to the last month),
+    each only using the months before it and the fitted params of results. Empty if the series ends before start+1.
+    mode="filter" reads them from the single Kalman filter pass over the full series that results already holds (O(n)),
+    mode="loop" builds & filters a model per prefix (O(n^2), kept to check the filter mode against).
+    """
 
-    df = db_handler.query(
-        f"""
-        SELECT
-            *
-        FROM
-            temp_crime_{ward_code}
-        """
-    )
+    end = len(df) - 1 if end is None else end
+    if start < 0 or end >= len(df):
+        raise ValueError(f"Invalid backtest window ({start}, {end}) for a series of {len(df)} months")
+
+    # Too few months to backtest: no one-step forecasts, the next month can still be forecast
+    if end <= start:
+        return pd.Series(np.empty(0), index=df.index[:0], name="forecast")
+
+    if mode == "filter":
+        return results.get_prediction(start=start + 1, end=end, dynamic=False).predicted_mean.rename("forecast")
 
-    db_handler.close_connection_db()
+    if mode != "loop":
+        raise ValueError(f"Unknown backtest mode '{mode}'")
+
+    forecasts = []
+    for t in range(start, end):
+        endog_train = df["num_of_crimes"][:t + 1]
+        exog_train = df[["avg_imd", "covid_index"]][:t + 1]
+        exog_forecast = df[["avg_imd", "covid_index"]][t + 1:t + 2]
+
+        model = sm.tsa.statespace.SARIMAX(
+            endog_train,
+            exog=exog_train,
+            order=p_d_q,
+            seasonal_order=p_d_q_s,
+            enforce_stationarity=False,
+            enforce_invertibility=False
+        )
+        step_model = model.filter(results.params)
+        forecasts.append(step_model.forecast(steps=1, exog=exog_forecast).values[0])
 
-    df["month"] = pd.to_datetime(df['month'])
+    return pd.Series(forecasts, index=df.index[start + 1:end + 1], name="forecast")
 
-    # Filter and aggregate by month
-    df = df.groupby("month").agg(
-        num_of_crimes=("crime_id", "count"),
-        avg_imd=("average_imd_decile", "mean"),
-        covid_index=("stringency_index", "first")
-    ).sort_index()
 
+def prepare_series(df: pd.DataFrame) -> tuple[pd.DataFrame, float]:
+    # Monthly frequency without gaps; returns the series & the ward's latest IMD (the KMeans weight)
     weight_imd = df["avg_imd"].iloc[-1]
 
     df = df.asfreq("MS")  # Monthly frequency
     df["num_of_crimes"] = df["num_of_crimes"].fillna(0)
     df["avg_imd"] = df["avg_imd"].interpolate()
 
+    return df, weight_imd
+
+
+def choose_order(df: pd.DataFrame) -> tuple[tuple, tuple]:
     # Check stationarity using ADFuller
     adfuller_test = adfuller(df["num_of_crimes"])
     # print(f"ADF p-value: {adfuller_test[1]}")
@@ -49,8 +84,11 @@ def timeseries(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_
         p_d_q = (1, 1, 1)
         p_d_q_s = (1, 1, 1, 12)
 
-    # Fit SARIMAX model
-    sarimax = sm.tsa.statespace.SARIMAX(
+    return p_d_q, p_d_q_s
+
+
+def build_sarimax(df: pd.DataFrame, p_d_q: tuple, p_d_q_s: tuple):
+    return sm.tsa.statespace.SARIMAX(
         df["num_of_crimes"],
         exog=df[["avg_imd", "covid_index"]],
         order=p_d_q,
@@ -58,48 +96,281 @@ def timeseries(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_
         enforce_stationarity=False,
         enforce_invertibility=False
     )
-    results = sarimax.fit(disp=False)
 
-    # Add forecast column
-    df["forecast"] = pd.NA
 
-    # One-step-ahead forecasts
-    for t in range(10, len(df) - 1):
-        endog_train = df["num_of_crimes"][:t + 1]
-        exog_train = df[["avg_imd", "covid_index"]][:t + 1]
-        exog_forecast = df[["avg_imd", "covid_index"]][t + 1:t + 2]
+def fit_sarimax(df: pd.DataFrame, p_d_q: tuple, p_d_q_s: tuple):
+    # Fit SARIMAX model
+    return build_sarimax(df, p_d_q, p_d_q_s).fit(disp=False)
 
-        model = sm.tsa.statespace.SARIMAX(
-            endog_train,
-            exog=exog_train,
-            order=p_d_q,
-            seasonal_order=p_d_q_s,
-            enforce_stationarity=False,
-            enforce_invertibility=False
+
+def series_hash(df: pd.DataFrame) -> str:
+    # Identifies the exact data a model was fitted on (months & values)
+    return hashlib.sha256(pd.util.hash_pandas_object(df[["num_of_crimes", "avg_imd", "covid_index"]], index=True).to_numpy().tobytes()).hexdigest()
+
+
+def fit_sarimax_with_store(df: pd.DataFrame, p_d_q: tuple, p_d_q_s: tuple, stored: dict | None=None, warm_start_maxiter: int=20) -> tuple:
+    """
+    Fits using the stored fit of this ward & order (see load_sarimax_params):
+    - same data as the stored fit: its params are reused, only the Kalman filter runs ("reused")
+    - otherwise the fit starts from the stored params with at most warm_start_maxiter iterations ("warm")
+    - no (matching) stored fit: a normal fit from the default start values ("cold")
+    Returns (results, fit_kind).
+    """
+
+    sarimax = build_sarimax(df, p_d_q, p_d_q_s)
+
+    stored_params = None
+    if stored is not None:
+        stored_params = json.loads(stored["params"])
+        if list(stored_params) != list(sarimax.param_names):
+            stored_params = None
+
+    if stored_params is None:
+        return sarimax.fit(disp=False), "cold"
+
+    start_params = np.array(list(stored_params.values()))
+    if stored["series_hash"] == series_hash(df):
+        return sarimax.filter(start_params), "reused"
+
+    return sarimax.fit(start_params=start_params, maxiter=warm_start_maxiter, disp=False), "warm"
+
+
+PARAM_STORE_COLUMNS = {
+    "ward_code": "TEXT",
+    "p_d_q": "TEXT",
+    "p_d_q_s": "TEXT",
+    "params": "TEXT",
+    "series_hash": "TEXT",
+    "n_months": "INTEGER",
+    "fit_kind": "TEXT",
+    "fit_seconds": "REAL",
+    "fitted_at": "TEXT",
+    "PRIMARY KEY": "(ward_code, p_d_q, p_d_q_s)"
+}
+
+
+def load_sarimax_params(db_loc: str="../data/", db_name: str="crime_data_UK_v4.db", ward_codes: list[str] | None=None) -> dict:
+    # Stored fits keyed on (ward_code, p_d_q json, p_d_q_s json)
+    with get_db_pool(db_loc=db_loc, db_name=db_name).reader() as db_handler:
+        if db_handler.con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sarimax_params'").fetchone() is None:
+            return {}
+
+        stored = db_handler.query("SELECT ward_code, p_d_q, p_d_q_s, params, series_hash FROM sarimax_params")
+
+    if ward_codes is not None:
+        stored = stored[stored["ward_code"].isin(ward_codes)]
+
+    return {(row["ward_code"], row["p_d_q"], row["p_d_q_s"]): row for row in stored.to_dict(orient="records")}
+
+
+def store_sarimax_params(fits: pd.DataFrame, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> None:
+    # fits: ward_code, p_d_q, p_d_q_s, params, series_hash, n_months, fit_kind, fit_seconds (reused fits don't change anything)
+    fits = fits[fits["fit_kind"] != "reused"]
+    if fits.empty:
+        return
+
+    with get_db_pool(db_loc=db_loc, db_name=db_name).writer() as db_handler:
+        db_handler.create_table("sarimax_params", columns=PARAM_STORE_COLUMNS)
+        db_handler.con.executemany(
+            """
+            INSERT OR REPLACE INTO sarimax_params (ward_code, p_d_q, p_d_q_s, params, series_hash, n_months, fit_kind, fit_seconds, fitted_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            """,
+            fits[["ward_code", "p_d_q", "p_d_q_s", "params", "series_hash", "n_months", "fit_kind", "fit_seconds"]].itertuples(index=False, name=None)
         )
-        step_model = model.filter(results.params)
-        forecast = step_model.forecast(steps=1, exog=exog_forecast)
+        db_handler.con.commit()
+
+
+#### Automatic order selection ####
+
+def order_grid(p: tuple=(0, 1, 2), d: tuple=(1,), q: tuple=(0, 1, 2), P: tuple=(0, 1), D: tuple=(1,), Q: tuple=(0, 1), s: int=12) -> list[tuple[tuple, tuple]]:
+    # All (p,d,q)(P,D,Q,s) combinations, simplest models first (those are evaluated first under a time budget)
+    grid = [((p_, d_, q_), (P_, D_, Q_, s)) for p_ in p for d_ in d for q_ in q for P_ in P for D_ in D for Q_ in Q]
+
+    return sorted(grid, key=lambda order: (order[0][0] + order[0][2] + order[1][0] + order[1][2], order))
+
+
+def score_order(df: pd.DataFrame, p_d_q: tuple, p_d_q_s: tuple, scoring: str="aic", backtest_start: int=10) -> float:
+    # Lower is better: AIC of the fit, or the mean absolute one-step backtest error
+    results = fit_sarimax(df, p_d_q, p_d_q_s)
+
+    if scoring == "aic":
+        return float(results.aic)
+
+    if scoring == "backtest":
+        backtest = backtest_one_step(df, results, p_d_q, p_d_q_s, start=backtest_start)
+        return float(np.abs(df["num_of_crimes"].loc[backtest.index] - backtest).mean())
+
+    raise ValueError(f"Unknown scoring '{scoring}'")
+
+
+def _score_order_worker(args: tuple) -> tuple[tuple, tuple, float]:
+    df, p_d_q, p_d_q_s, scoring = args
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            score = score_order(df, p_d_q, p_d_q_s, scoring)
+        except Exception:
+            score = np.inf
+
+    return p_d_q, p_d_q_s, score if np.isfinite(score) else np.inf
+
+
+def search_order(df: pd.DataFrame, grid: list[tuple[tuple, tuple]] | None=None, scoring: str="aic", time_budget: float=30.0, n_workers: int=1) -> dict:
+    """
+    Scores the candidate orders of grid (default order_grid()) and returns the best one.
+    Candidates are evaluated simplest first, across n_workers processes (n_workers=1: in this process,
+    e.g. inside a batch worker). Once time_budget seconds have passed the remaining candidates are dropped.
+    Falls back to choose_order when no candidate could be fitted.
+    """
+
+    grid = order_grid() if grid is None else grid
+    tasks = [(df, p_d_q, p_d_q_s, scoring) for p_d_q, p_d_q_s in grid]
+    deadline = time.time() + time_budget
+    t0 = time.time()
+
+    scores = []
+    if n_workers == 1:
+        for task in tasks:
+            if time.time() > deadline:
+                break
+            scores.append(_score_order_worker(task))
+    else:
+        pool = Pool(n_workers)
+        try:
+            candidates = pool.imap_unordered(_score_order_worker, tasks)
+            for _ in tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    scores.append(candidates.next(timeout=remaining))
+                except PoolTimeoutError:
+                    break
+        finally:
+            # Drops the candidates still running or queued
+            pool.terminate()
+
+    scores = [score for score in scores if np.isfinite(score[2])]
+    if scores:
+        p_d_q, p_d_q_s, score = min(scores, key=lambda score: score[2])
+    else:
+        (p_d_q, p_d_q_s), score = choose_order(df), np.nan
+
+    return {
+        "p_d_q": p_d_q,
+        "p_d_q_s": p_d_q_s,
+        "scoring": scoring,
+        "score": score,
+        "n_candidates": len(tasks),
+        "n_evaluated": len(scores),
+        "search_seconds": time.time() - t0
+    }
+
+
+def load_cached_orders(db_loc: str="../data/", db_name: str="crime_data_UK_v4.db", ward_codes: list[str] | None=None, scoring: str="aic", max_age_days: float=30) -> dict:
+    # Searched orders per ward that are younger than max_age_days (older ones are due for a new search)
+    with get_db_pool(db_loc=db_loc, db_name=db_name).reader() as db_handler:
+        if db_handler.con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sarimax_orders'").fetchone() is None:
+            return {}
+
+        cached = db_handler.query(
+            "SELECT ward_code, p_d_q, p_d_q_s FROM sarimax_orders WHERE scoring = ? AND searched_at >= datetime('now', ?)",
+            params=(scoring, f"-{max_age_days} days")
+        )
+
+    if ward_codes is not None:
+        cached = cached[cached["ward_code"].isin(ward_codes)]
+
+    return {row["ward_code"]: (tuple(json.loads(row["p_d_q"])), tuple(json.loads(row["p_d_q_s"]))) for row in cached.to_dict(orient="records")}
+
+
+def store_orders(searches: pd.DataFrame, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> None:
+    # searches: ward_code plus the search_order() fields
+    with get_db_pool(db_loc=db_loc, db_name=db_name).writer() as db_handler:
+        db_handler.create_table("sarimax_orders", columns={
+            "ward_code": "TEXT PRIMARY KEY",
+            "p_d_q": "TEXT",
+            "p_d_q_s": "TEXT",
+            "scoring": "TEXT",
+            "score": "REAL",
+            "n_candidates": "INTEGER",
+            "n_evaluated": "INTEGER",
+            "search_seconds": "REAL",
+            "searched_at": "TEXT"
+        })
+        db_handler.con.executemany(
+            """
+            INSERT OR REPLACE INTO sarimax_orders (ward_code, p_d_q, p_d_q_s, scoring, score, n_candidates, n_evaluated, search_seconds, searched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            """,
+            [
+                (row["ward_code"], json.dumps(row["p_d_q"]), json.dumps(row["p_d_q_s"]), row["scoring"], row["score"], row["n_candidates"], row["n_evaluated"], row["search_seconds"])
+                for row in searches.to_dict(orient="records")
+            ]
+        )
+        db_handler.con.commit()
+
+
+def select_order(ward_code: str, df: pd.DataFrame, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db", order_selection: str="cached", scoring: str="aic", time_budget: float=30.0, n_workers: int | None=None, max_age_days: float=30) -> tuple[tuple, tuple]:
+    # Order for one ward: "adfuller" (the two fixed orders), "cached" (order found by the batch search, else adfuller;
+    # never searches, so it's cheap enough for a request) or "search" (cached search result, searched again once outdated)
+    if order_selection == "adfuller":
+        return choose_order(df)
+
+    if order_selection not in ["cached", "search"]:
+        raise ValueError(f"Unknown order selection '{order_selection}'")
+
+    cached = load_cached_orders(db_loc=db_loc, db_name=db_name, ward_codes=[ward_code], scoring=scoring, max_age_days=max_age_days)
+    if ward_code in cached:
+        return cached[ward_code]
+
+    if order_selection == "cached":
+        return choose_order(df)
 
-        df.loc[df.index[t + 1], "forecast"] = forecast.values[0]
+    found = search_order(df, scoring=scoring, time_budget=time_budget, n_workers=n_workers or psutil.cpu_count(logical=False))
+    store_orders(pd.DataFrame([{"ward_code": ward_code, **found}]), db_loc=db_loc, db_name=db_name)
+
+    return found["p_d_q"], found["p_d_q_s"]
+
+
+def forecast_following_month(df: pd.DataFrame, results) -> float:
+    # Forecast for the next unseen month (results already holds the filter over the full series)
+    exog_forecast = [df[["avg_imd", "covid_index"]].iloc[-1]]  # Use last value as estimate
+
+    return results.forecast(steps=1, exog=exog_forecast).iloc[0]
+
+
+def timeseries(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db", backtest_start: int=10, backtest_end: int | None=None, backtest_mode: str="filter", order_selection: str="cached", scoring: str="aic", time_budget: float=30.0):
+    # Request path: the order comes from the batch search or adfuller, order_selection="search" opts into a search here
+    # Monthly aggregates come from the ward x month cube (or a GROUP BY month in SQLite for wards not in it)
+    df, weight_imd = prepare_series(get_ward_month_series(ward_code, db_loc=db_loc, db_name=db_name))
+
+    p_d_q, p_d_q_s = select_order(ward_code, df, db_loc=db_loc, db_name=db_name, order_selection=order_selection, scoring=scoring, time_budget=time_budget)
+
+    # Warm start from (or reuse) this ward's stored fit
+    stored = load_sarimax_params(db_loc=db_loc, db_name=db_name, ward_codes=[ward_code]).get((ward_code, json.dumps(p_d_q), json.dumps(p_d_q_s)))
+    t0 = time.time()
+    results, fit_kind = fit_sarimax_with_store(df, p_d_q, p_d_q_s, stored)
+    store_sarimax_params(pd.DataFrame([{
+        "ward_code": ward_code, "p_d_q": json.dumps(p_d_q), "p_d_q_s": json.dumps(p_d_q_s),
+        "params": json.dumps({name: float(value) for name, value in results.params.items()}),
+        "series_hash": series_hash(df), "n_months": len(df), "fit_kind": fit_kind, "fit_seconds": time.time() - t0
+    }]), db_loc=db_loc, db_name=db_name)
+
+    # Add forecast column
+    df["forecast"] = pd.NA
+
+    # One-step-ahead forecasts
+    forecast = backtest_one_step(df, results, p_d_q, p_d_q_s, start=backtest_start, end=backtest_end, mode=backtest_mode)
+    df.loc[forecast.index, "forecast"] = forecast.values
 
     # Forecast for the next unseen month
     last_index = df.index[-1]
     next_index = last_index + pd.DateOffset(months=1)
 
-    endog_train = df["num_of_crimes"]
-    exog_train = df[["avg_imd", "covid_index"]]
-    exog_forecast = [df[["avg_imd", "covid_index"]].iloc[-1]]  # Use last value as estimate
-
-    model = sm.tsa.statespace.SARIMAX(
-        endog_train,
-        exog=exog_train,
-        order=p_d_q,
-        seasonal_order=p_d_q_s,
-        enforce_stationarity=False,
-        enforce_invertibility=False
-    )
-    step_model = model.filter(results.params)
-    forecast_next_month = step_model.forecast(steps=1, exog=exog_forecast).iloc[0]
+    forecast_next_month = forecast_following_month(df, results)
 
     # Plotly figure
     fig = go.Figure()
@@ -107,7 +378,7 @@ def timeseries(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_
     actual_x, actual_y = [], []
     forecast_x, forecast_y = [], []
 
-    for i in range(10, len(df) - 1):
+    for i in range(backtest_start, len(df) - 1):
         t = df.index[i]
         t_next = df.index[i + 1]
 
@@ -164,3 +435,172 @@ def timeseries(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_
     )
 
     return fig, forecast_next_month, weight_imd
+
+
+#### Batch forecasting of all wards ####
+
+def forecast_ward(ward_code: str, series: pd.DataFrame, stored_params: dict={}, cached_order: tuple | None=None, order_selection: str="search", scoring: str="aic", time_budget: float=30.0, backtest_start: int=10) -> dict:
+    """
+    Fit, one-step backtest & next month forecast of one ward, without plotting.
+    stored_params holds the ward's stored fits (see load_sarimax_params) to warm start from or reuse.
+    Without a cached_order the order is searched in this process (order_selection="search") or picked by adfuller.
+    Never raises: a ward that can't be modelled comes back with status 'failed' and the error.
+    """
+
+    t0 = time.time()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+
+            df, weight_imd = prepare_series(series)
+
+            order_search = None
+            if cached_order is not None:
+                p_d_q, p_d_q_s = cached_order
+            elif order_selection == "search":
+                order_search = search_order(df, scoring=scoring, time_budget=time_budget, n_workers=1)
+                p_d_q, p_d_q_s = order_search["p_d_q"], order_search["p_d_q_s"]
+            else:
+                p_d_q, p_d_q_s = choose_order(df)
+
+            t_fit = time.time()
+            results, fit_kind = fit_sarimax_with_store(df, p_d_q, p_d_q_s, stored_params.get((ward_code, json.dumps(p_d_q), json.dumps(p_d_q_s))))
+            model_fit_seconds = time.time() - t_fit
+
+            backtest = backtest_one_step(df, results, p_d_q, p_d_q_s, start=backtest_start)
+            errors = df["num_of_crimes"].loc[backtest.index] - backtest
+
+            return {
+                "ward_code": ward_code,
+                "forecast_month": (df.index[-1] + pd.DateOffset(months=1)).strftime("%Y-%m"),
+                "forecast": float(forecast_following_month(df, results)),
+                "weight_imd": float(weight_imd),
+                "p_d_q": json.dumps(p_d_q),
+                "p_d_q_s": json.dumps(p_d_q_s),
+                "params": json.dumps({name: float(value) for name, value in results.params.items()}),
+                "backtest_mae": float(np.abs(errors).mean()),
+                "backtest_rmse": float(np.sqrt((errors**2).mean())),
+                "n_months": len(df),
+                "series_hash": series_hash(df),
+                "fit_kind": fit_kind,
+                "model_fit_seconds": model_fit_seconds,
+                "order_search": order_search,
+                "fit_seconds": time.time() - t0,
+                "status": "done",
+                "error": None
+            }
+    except Exception as e:
+        return {"ward_code": ward_code, "fit_seconds": time.time() - t0, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+
+def _forecast_ward_worker(kwargs: dict) -> dict:
+    return forecast_ward(**kwargs)
+
+
+def run_batch_forecasts(db_loc: str="../data/", db_name: str="crime_data_UK_v4.db", ward_codes: list[str] | None=None, n_workers: int | None=None, order_selection: str="search", scoring: str="aic", time_budget: float=30.0, max_age_days: float=30) -> pd.DataFrame:
+    """
+    Fits & forecasts every ward (or ward_codes) in a process pool and (re)writes their rows in ward_forecasts,
+    tagged with the ward_month_stats version they were fitted on. Prints per-ward fit times & throughput.
+    With order_selection="search", wards without a cached order younger than max_age_days get an order search
+    (time_budget seconds each, inside their worker) and the found orders are cached.
+    """
+
+    cube = get_ward_month_cube(db_loc=db_loc, db_name=db_name)
+    ward_codes = list(cube.ward_codes) if ward_codes is None else ward_codes
+    n_workers = n_workers or psutil.cpu_count(logical=False)
+
+    # Each task carries its own (small) monthly series & stored fits, workers don't touch the database
+    stored_params = load_sarimax_params(db_loc=db_loc, db_name=db_name, ward_codes=ward_codes)
+    stored_per_ward = {}
+    for key, stored in stored_params.items():
+        stored_per_ward.setdefault(key[0], {})[key] = stored
+
+    cached_orders = load_cached_orders(db_loc=db_loc, db_name=db_name, ward_codes=ward_codes, scoring=scoring, max_age_days=max_age_days) if order_selection == "search" else {}
+
+    tasks = [
+        {
+            "ward_code": ward_code,
+            "series": cube.series(ward_code),
+            "stored_params": stored_per_ward.get(ward_code, {}),
+            "cached_order": cached_orders.get(ward_code),
+            "order_selection": order_selection,
+            "scoring": scoring,
+            "time_budget": time_budget
+        }
+        for ward_code in ward_codes
+    ]
+
+    t0 = time.time()
+    with Pool(n_workers) as pool:
+        forecasts = pd.DataFrame(list(tqdm(pool.imap_unordered(_forecast_ward_worker, tasks), total=len(tasks))))
+    elapsed = time.time() - t0
+
+    forecasts["stats_version"] = cube.version
+
+    fits = forecasts[forecasts["status"] == "done"]
+    if not fits.empty:
+        store_sarimax_params(fits.assign(fit_seconds=fits["model_fit_seconds"]), db_loc=db_loc, db_name=db_name)
+
+        searches = [{"ward_code": row["ward_code"], **row["order_search"]} for row in fits.to_dict(orient="records") if isinstance(row["order_search"], dict)]
+        if searches:
+            store_orders(pd.DataFrame(searches), db_loc=db_loc, db_name=db_name)
+            print(f"\nSearched orders for {len(searches)} wards (mean {np.mean([search['search_seconds'] for search in searches]):.1f}s per ward).")
+
+    columns = {
+        "ward_code": "TEXT PRIMARY KEY",
+        "forecast_month": "TEXT",
+        "forecast": "REAL",
+        "weight_imd": "REAL",
+        "p_d_q": "TEXT",
+        "p_d_q_s": "TEXT",
+        "params": "TEXT",
+        "backtest_mae": "REAL",
+        "backtest_rmse": "REAL",
+        "n_months": "INTEGER",
+        "fit_seconds": "REAL",
+        "stats_version": "INTEGER",
+        "status": "TEXT",
+        "error": "TEXT"
+    }
+    forecasts = forecasts.reindex(columns=list(columns))
+
+    with get_db_pool(db_loc=db_loc, db_name=db_name).writer() as db_handler:
+        db_handler.create_table("ward_forecasts", columns=columns)
+        db_handler.con.executemany("DELETE FROM ward_forecasts WHERE ward_code = ?", [(ward_code,) for ward_code in forecasts["ward_code"]])
+        db_handler.insert_dataframe("ward_forecasts", forecasts, loader_pragmas=False)
+
+    if not fits.empty:
+        print("\nModel fit time by kind (reused: no new data, warm: started from the stored params):")
+        print(fits.groupby("fit_kind")["model_fit_seconds"].agg(["count", "mean", "sum"]).to_string())
+
+    fit_seconds = forecasts["fit_seconds"]
+    print(f"\nForecasted {len(forecasts)} wards in {elapsed:.1f}s with {n_workers} workers ({len(forecasts) / max(elapsed, 1e-9):.1f} wards/s)")
+    print(f"Fit time per ward: mean {fit_seconds.mean():.2f}s, median {fit_seconds.median():.2f}s, max {fit_seconds.max():.2f}s")
+    print(f"Failed wards: {(forecasts['status'] == 'failed').sum()}\n")
+
+    return forecasts
+
+
+def get_ward_forecast(ward_code: str, db_loc: str="../data/", db_name: str="crime_data_UK_v4.db") -> tuple[float, float] | None:
+    # (forecast, weight_imd) from the batch run, None if it's missing, failed or fitted on older ward_month_stats
+    with get_db_pool(db_loc=db_loc, db_name=db_name).reader() as db_handler:
+        try:
+            row = db_handler.con.execute(
+                "SELECT forecast, weight_imd, stats_version FROM ward_forecasts WHERE ward_code = ? AND status = 'done'",
+                (ward_code,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # ward_forecasts doesn't exist yet
+            return None
+
+        if row is None or row[2] != get_table_version(db_handler, "ward_month_stats"):
+            return None
+
+    return row[0], row[1]
+
+
+if __name__ == "__main__":
+
+    # Usage: python SARIMAX.py [db_name]  (batch forecast of all wards)
+    db_name = sys.argv[1] if len(sys.argv) > 1 else "crime_data_UK_v4.db"
+    run_batch_forecasts(db_loc="../data/", db_name=db_name)
@@ -1,5 +1,6 @@
-from ML_utils import create_temp_table, delete_temp_table
-from SARIMAX import timeseries
+from DB_utils import get_db_pool, close_all_db_pools, QueryProfiler
+from ML_utils import ward_slice_cache_stats
+from SARIMAX import timeseries, get_ward_forecast
 from KMeans import run_kmeans_weighted, plot_kmeans_clusters, calc_avg_distance_between_crime_and_officer
 
 
@@ -16,11 +17,16 @@ if __name__ == "__main__":
     ward_code = "E05000138"
     num_police_officers = 100
 
-    # Create temporary table to work with for ML models
-    create_temp_table(ward_code=ward_code, db_loc=db_loc, db_name=db_name)
+    # Profile every statement the model layer runs
+    profiler = QueryProfiler()
+    get_db_pool(db_loc=db_loc, db_name=db_name).profiler = profiler
 
-    # Run timeseries 
-    timeseries_figure, number_of_predicted_crimes, weight_imd = timeseries(ward_code=ward_code, db_loc=db_loc, db_name=db_name)
+    # Forecast from the batch run (python SARIMAX.py), fit on demand if it's missing or outdated
+    ward_forecast = get_ward_forecast(ward_code=ward_code, db_loc=db_loc, db_name=db_name)
+    if ward_forecast is not None:
+        number_of_predicted_crimes, weight_imd = ward_forecast
+    else:
+        timeseries_figure, number_of_predicted_crimes, weight_imd = timeseries(ward_code=ward_code, db_loc=db_loc, db_name=db_name)
 
     # Run KMeans
     centroids, clustered_data = run_kmeans_weighted(ward_code=ward_code, n_crimes=number_of_predicted_crimes, imd_value=weight_imd, n_clusters=num_police_officers, db_loc=db_loc, db_name=db_name)
@@ -35,8 +41,12 @@ if __name__ == "__main__":
     print(f"\nAverage euclidean distance of a police officer to a crime: {mean_dist} [m]")
     print(f"Maximum euclidean distance of a police officer to a crime: {max_dist} [m]\n")
 
-    # Delete temp table
-    delete_temp_table(ward_code=ward_code, db_loc=db_loc, db_name=db_name)
+    # Connection pool usage (to size max_readers)
+    print("DB pool stats:", get_db_pool(db_loc=db_loc, db_name=db_name).stats())
+    print("Ward slice cache stats:", ward_slice_cache_stats())
+    print(profiler.summary())
+    profiler.to_json("query_profile.json")
+    close_all_db_pools()
 
     # Return results to dashboard & show it
     ######### ??? ######
@@ -1,10 +1,217 @@
 import pandas as pd
+import numpy as np
+import shapely
 from shapely import wkt
-from shapely.geometry import Point
 import geopandas as gpd
 
 
-def join_tables(crime_data: pd.DataFrame, ward_data: pd.DataFrame, imd_data: pd.DataFrame) -> gpd.GeoDataFrame:
+def add_projected_geometry(db_handler, table_name: str, key_column: str, simplify_tolerance: float=0.0001) -> int:
+    """
+    Stores the EPSG:27700 WKT geometry of table_name once more as EPSG:4326 WKB (geometry_wkb),
+    plus a simplified variant (geometry_simplified_wkb, tolerance in degrees) and bounding box columns,
+    so readers can skip WKT parsing and reprojection.
+    """
+
+    existing_columns = [row[1] for row in db_handler.con.execute(f"PRAGMA table_info({table_name})").fetchall()]
+    new_columns = {
+        "geometry_wkb": "BLOB",
+        "geometry_simplified_wkb": "BLOB",
+        "min_long": "REAL",
+        "min_lat": "REAL",
+        "max_long": "REAL",
+        "max_lat": "REAL"
+    }
+    for column, datatype in new_columns.items():
+        if column not in existing_columns:
+            db_handler.update(f"ALTER TABLE {table_name} ADD COLUMN {column} {datatype}")
+
+    geometry_df = db_handler.query(f"SELECT {key_column}, geometry FROM {table_name}")
+    if geometry_df.empty:
+        return 0
+
+    geometries = gpd.GeoSeries(shapely.from_wkt(geometry_df["geometry"].to_numpy()), crs="EPSG:27700").to_crs("EPSG:4326").to_numpy()
+    simplified = shapely.simplify(geometries, simplify_tolerance, preserve_topology=True)
+    bounds = shapely.bounds(geometries)
+
+    rows = zip(
+        shapely.to_wkb(geometries).tolist(),
+        shapely.to_wkb(simplified).tolist(),
+        bounds[:, 0].tolist(), bounds[:, 1].tolist(), bounds[:, 2].tolist(), bounds[:, 3].tolist(),
+        geometry_df[key_column].tolist()
+    )
+
+    db_handler.con.executemany(
+        f"""
+        UPDATE {table_name}
+        SET geometry_wkb = ?, geometry_simplified_wkb = ?, min_long = ?, min_lat = ?, max_long = ?, max_lat = ?
+        WHERE {key_column} = ?
+        """,
+        rows
+    )
+    db_handler.con.commit()
+
+    return len(geometry_df)
+
+
+def build_ward_gdf(ward_data: pd.DataFrame) -> gpd.GeoDataFrame:
+    # Already prepared (e.g. shared by the parent process)
+    if isinstance(ward_data, gpd.GeoDataFrame) and ward_data.crs == "EPSG:4326":
+        return ward_data
+
+    ward_data = ward_data.copy()
+
+    if "geometry_wkb" in ward_data.columns and ward_data["geometry_wkb"].notna().all():
+        # Pre-projected WKB, no parsing of text or reprojection needed
+        ward_data['geometry'] = shapely.from_wkb(ward_data['geometry_wkb'].to_numpy())
+        ward_gdf = gpd.GeoDataFrame(ward_data.drop(columns=["geometry_wkb", "geometry_simplified_wkb"], errors="ignore"), geometry='geometry', crs="EPSG:4326")
+    else:
+        # Load ward geometries from WKT and reproject
+        ward_data['geometry'] = ward_data['geometry'].map(wkt.loads)
+        ward_gdf = gpd.GeoDataFrame(ward_data, geometry='geometry', crs="EPSG:27700").to_crs("EPSG:4326")
+
+    ward_gdf.sindex  # build spatial index (implicitly used by sjoin)
+    return ward_gdf
+
+
+def resolve_point_wards(points: pd.DataFrame, ward_gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    Point-in-polygon test for every distinct (long, lat) in points.
+    Returns one row per distinct coordinate with its ward_code & ward_name (NaN if outside all wards).
+    """
+
+    unique_points = points[["long", "lat"]].dropna().drop_duplicates().reset_index(drop=True)
+
+    points_gdf = gpd.GeoDataFrame(
+        unique_points,
+        geometry=gpd.points_from_xy(unique_points['long'], unique_points['lat']),
+        crs="EPSG:4326"
+    )
+
+    result = gpd.sjoin(
+        points_gdf,
+        ward_gdf[['ward_code', 'ward_name', 'geometry']],
+        how="left",
+        predicate="within"
+    )
+
+    # A point on overlapping wards keeps its first match
+    return pd.DataFrame(result[["long", "lat", "ward_code", "ward_name"]]).drop_duplicates(subset=["long", "lat"], ignore_index=True)
+
+
+def update_point_ward_lookup(db_handler, ward_data: pd.DataFrame, ward_version: int, crime_table: str="crime_raw", skip_single_ward_lsoas: bool=False) -> int:
+    """
+    Keeps the point_ward_lookup table in sync with crime_table: only coordinates that were never seen before
+    get a point-in-polygon test. Police data is snapped to a limited set of points, so this stays small.
+    With skip_single_ward_lsoas, crimes whose LSOA lies inside one ward (lsoa_ward_lookup) are left out.
+    Every row carries the ward_location version (table_versions) of ward_data it was resolved against,
+    rows resolved against other ward boundaries are dropped and their points resolved again.
+    """
+
+    # Lookups from before the version column can't be trusted either
+    existing_columns = [row[1] for row in db_handler.con.execute("PRAGMA table_info(point_ward_lookup)").fetchall()]
+    if existing_columns and "ward_version" not in existing_columns:
+        db_handler.delete_table("point_ward_lookup")
+
+    db_handler.create_table("point_ward_lookup", columns={
+        "long": "REAL",
+        "lat": "REAL",
+        "ward_code": "TEXT",
+        "ward_name": "TEXT",
+        "ward_version": "INTEGER",
+        "PRIMARY KEY": "(long, lat)"
+    })
+    db_handler.update("DELETE FROM point_ward_lookup WHERE ward_version IS NOT ?", params=(ward_version,))
+
+    lsoa_filter = ""
+    if skip_single_ward_lsoas:
+        lsoa_filter = "AND c.lsoa_code NOT IN (SELECT lsoa_code FROM lsoa_ward_lookup WHERE single_ward = 1)"
+
+    new_points = db_handler.query(
+        f"""
+        SELECT DISTINCT
+            c.long,
+            c.lat
+        FROM
+            {crime_table} c
+        LEFT JOIN
+            point_ward_lookup p
+            ON p.long = c.long AND p.lat = c.lat
+        WHERE
+            p.long IS NULL
+            AND c.long IS NOT NULL
+            AND c.lat IS NOT NULL
+            {lsoa_filter}
+        """
+    )
+
+    if new_points.empty:
+        return 0
+
+    point_wards = resolve_point_wards(new_points, build_ward_gdf(ward_data)).assign(ward_version=ward_version)
+    db_handler.insert_dataframe("point_ward_lookup", point_wards)
+
+    return len(point_wards)
+
+
+def build_lsoa_ward_lookup(lsoa_data: pd.DataFrame, ward_data: pd.DataFrame, min_area_share: float=1 - 1e-6) -> pd.DataFrame:
+    """
+    Polygon overlay of LSOAs & wards (both in their stored EPSG:27700 WKT, so no reprojection noise).
+    Returns one row per overlapping (lsoa_code, ward_code) pair with the share of the LSOA's area inside that ward;
+    single_ward is 1 for LSOAs that lie (up to min_area_share) entirely inside one ward.
+    """
+
+    lsoa_geometries = shapely.from_wkt(lsoa_data["geometry"].to_numpy())
+    ward_geometries = shapely.from_wkt(ward_data["geometry"].to_numpy())
+
+    # Candidate pairs from the bounding boxes, exact intersection areas only for those
+    lsoa_idx, ward_idx = shapely.STRtree(ward_geometries).query(lsoa_geometries, predicate="intersects")
+    lsoa_area = shapely.area(lsoa_geometries)
+    overlap_area = shapely.area(shapely.intersection(lsoa_geometries[lsoa_idx], ward_geometries[ward_idx]))
+
+    lookup = pd.DataFrame({
+        "lsoa_code": lsoa_data["lsoa_code"].to_numpy()[lsoa_idx],
+        "ward_code": ward_data["ward_code"].to_numpy()[ward_idx],
+        "ward_name": ward_data["ward_name"].to_numpy()[ward_idx],
+        "area_share": overlap_area / np.where(lsoa_area[lsoa_idx] > 0, lsoa_area[lsoa_idx], 1.0)
+    })
+    # Touching only along an edge
+    lookup = lookup[lookup["area_share"] > 0].reset_index(drop=True)
+
+    lookup["single_ward"] = (lookup["area_share"] >= min_area_share).astype(int)
+
+    return lookup.sort_values(["lsoa_code", "area_share"], ascending=[True, False], ignore_index=True)
+
+
+def update_lsoa_ward_lookup(db_handler, min_area_share: float=1 - 1e-6) -> int:
+    """
+    Rebuilds the lsoa_ward_lookup table from lsoa_location & ward_location.
+    Returns the number of LSOAs inside a single ward (their crimes get a ward without point-in-polygon test).
+    """
+
+    lsoa_data = db_handler.query("SELECT lsoa_code, geometry FROM lsoa_location")
+    ward_data = db_handler.query("SELECT ward_code, ward_name, geometry FROM ward_location")
+
+    lookup = build_lsoa_ward_lookup(lsoa_data, ward_data, min_area_share)
+
+    db_handler.delete_table("lsoa_ward_lookup")
+    db_handler.create_table("lsoa_ward_lookup", columns={
+        "lsoa_code": "TEXT",
+        "ward_code": "TEXT",
+        "ward_name": "TEXT",
+        "area_share": "REAL",
+        "single_ward": "INTEGER",
+        "PRIMARY KEY": "(lsoa_code, ward_code)"
+    })
+    db_handler.insert_dataframe("lsoa_ward_lookup", lookup)
+
+    n_single_ward = int(lookup["single_ward"].sum())
+    if db_handler.verbose==1:
+        print(f"\n{n_single_ward} of {lookup['lsoa_code'].nunique()} LSOAs lie inside a single ward.\n")
+
+    return n_single_ward
+
+
+def join_tables(crime_data: pd.DataFrame, ward_data: pd.DataFrame, imd_data: pd.DataFrame, point_wards: pd.DataFrame | None = None, lsoa_wards: pd.DataFrame | None = None) -> pd.DataFrame:
     # Step 1: Rename IMD column and merge (already fast)
     avg_imd_per_lsoa = imd_data.rename(columns={'value': 'average_imd_decile'})
     crime_and_imd_data = crime_data.merge(
@@ -14,22 +221,41 @@ def join_tables(crime_data: pd.DataFrame, ward_data: pd.DataFrame, imd_data: pd.
         right_on="feature_code"
     )
 
-    # Step 2: Vectorized Point creation
-    crime_and_imd_data['geometry'] = gpd.points_from_xy(crime_and_imd_data['long'], crime_and_imd_data['lat'])
-    crime_and_imd_gdf = gpd.GeoDataFrame(crime_and_imd_data, geometry='geometry', crs="EPSG:4326")
+    # Step 2: Crimes in an LSOA that lies inside a single ward get that ward by lookup
+    if lsoa_wards is not None:
+        single_ward_lsoas = lsoa_wards[lsoa_wards["single_ward"] == 1]
+        lsoa_pos = pd.Index(single_ward_lsoas["lsoa_code"]).get_indexer(crime_and_imd_data["lsoa_code"])
+    else:
+        single_ward_lsoas = pd.DataFrame({"ward_code": pd.Series(dtype="str"), "ward_name": pd.Series(dtype="str")})
+        lsoa_pos = np.full(len(crime_and_imd_data), -1)
 
-    # Step 3: Load ward geometries from WKT and reproject
-    ward_data['geometry'] = ward_data['geometry'].map(wkt.loads)
-    ward_gdf = gpd.GeoDataFrame(ward_data, geometry='geometry', crs="EPSG:27700").to_crs("EPSG:4326")
+    ward_code = single_ward_lsoas["ward_code"].array.take(lsoa_pos, allow_fill=True)
+    ward_name = single_ward_lsoas["ward_name"].array.take(lsoa_pos, allow_fill=True)
 
-    # Step 4: Spatial index for faster spatial join
-    ward_gdf.sindex  # build spatial index (implicitly used by sjoin)
-    result = gpd.sjoin(
-        crime_and_imd_gdf,
-        ward_gdf[['ward_code', 'ward_name', 'geometry']],
+    needs_spatial = lsoa_pos < 0
+    if not needs_spatial.any():
+        return crime_and_imd_data.assign(ward_code=ward_code, ward_name=ward_name)
+
+    remaining = crime_and_imd_data.loc[needs_spatial, ["long", "lat"]]
+
+    # Step 3: Spatial join for the rest, once per distinct coordinate not already in the lookup
+    if point_wards is None:
+        point_wards = resolve_point_wards(remaining, build_ward_gdf(ward_data))
+    else:
+        known = remaining.merge(point_wards[["long", "lat"]], how="left", on=["long", "lat"], indicator=True)
+        unknown_points = remaining.loc[(known["_merge"] == "left_only").to_numpy()]
+
+        if not unknown_points.dropna().empty:
+            new_point_wards = resolve_point_wards(unknown_points, build_ward_gdf(ward_data))
+            point_wards = pd.concat([point_wards, new_point_wards], ignore_index=True)
+
+    # Step 4: Attach wards to the remaining crimes by coordinate
+    remaining_wards = remaining.merge(
+        point_wards[["long", "lat", "ward_code", "ward_name"]],
         how="left",
-        predicate="within"
+        on=["long", "lat"]
     )
-    
-    return result
+    ward_code[needs_spatial] = remaining_wards["ward_code"].array
+    ward_name[needs_spatial] = remaining_wards["ward_name"].array
 
+    return crime_and_imd_data.assign(ward_code=ward_code, ward_name=ward_name)